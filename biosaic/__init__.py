@@ -1,6 +1,36 @@
-from .main import tokenizer
-from .main import pre_encoding as get_encodings
-from .main import pre_model as get_models
-from .main import pre_mode as get_modes
-from .database import get_database
-from .process import consolidate, parquet_to_csv, parquet_to_text, split_file, unzip, cleanse_db
\ No newline at end of file
+import importlib
+
+# public names are resolved on first access, so `import biosaic` stays free of numpy, pandas,
+# Biopython & friends until the submodule that needs them is actually used
+_lazy_attrs = {
+  "tokenizer": (".main", "tokenizer"),
+  "get_encodings": (".main", "pre_encoding"),
+  "get_models": (".main", "pre_model"),
+  "get_modes": (".main", "pre_mode"),
+  "get_database": (".database", "get_database"),
+  "consolidate": (".process", "consolidate"),
+  "parquet_to_csv": (".process", "parquet_to_csv"),
+  "parquet_to_text": (".process", "parquet_to_text"),
+  "parquet_to_shards": (".process", "parquet_to_shards"),
+  "split_file": (".process", "split_file"),
+  "unzip": (".process", "unzip"),
+  "gz_to_shards": (".process", "gz_to_shards"),
+  "cleanse_db": (".process", "cleanse_db"),
+  "FastaIndex": (".fasta", "FastaIndex"),
+  "read_sequences": (".fasta", "read_sequences"),
+  "metrics": (".metrics", "metrics"),
+  "profile": (".metrics", "profile"),
+  "set_log_level": (".metrics", "set_log_level"),
+}
+__all__ = list(_lazy_attrs)
+
+def __getattr__(name):
+  if name not in _lazy_attrs:
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+  module, attr = _lazy_attrs[name]
+  value = getattr(importlib.import_module(module, __name__), attr)
+  globals()[name] = value
+  return value
+
+def __dir__():
+  return sorted(set(globals()) | set(__all__))
@@ -23,11 +23,12 @@ class Dataset:
       path (str): Path to the DNA data file
       kmer (int): kmer size for the tokenizer & encodings
       ratio (float): Fraction of data to use for testing (default 0.2)
-      random_seed (int): random seeding for batching"""
-  def __init__(self, path:str, kmer:int, ratio:float=0.25, random_seed:int=1600):
+      random_seed (int): random seeding for batching
+      canonical (bool): strand-agnostic k-mer ids, halves the one-hot/embedding width"""
+  def __init__(self, path:str, kmer:int, ratio:float=0.25, random_seed:int=1600, canonical:bool=False):
     self.path, self.ratio, self.random_seed  = path, ratio, random_seed
     self.kmer_size = kmer if kmer else 4
-    self.tokenizer = biosaic.tokenizer(encoding=biosaic.get_encodings[3])
+    self.tokenizer = biosaic.tokenizer(encoding=biosaic.get_encodings[3], canonical=canonical)
     self.n_classes = self.tokenizer.vocab_size
     self.train_data, self.val_data = "", ""
     self.load_and_format_data()
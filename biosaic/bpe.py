@@ -1,9 +1,15 @@
 from itertools import product
-import multiprocessing, timeit
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from collections import Counter
+import multiprocessing, timeit, atexit, threading, logging
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter, OrderedDict
 from array import array
-import os, json, pickle
+import os, json, pickle, heapq
+import numpy as np
+from .metrics import logger, metrics
+from .fasta import read_sequences
+from .vocabfile import VocabFile, write_vocab, read_legacy, infer_merges
+from .kmer import RaggedIds, INVALID_CODE, as_id_array, base_codes, kmer_ids, _bad_windows, _good_runs, _iter_bases
 
 AMINO_ACIDS = [
   'A','R','N','D','C','Q','E','G','H','I',
@@ -15,36 +21,118 @@ ID2AA = {i: aa for aa, i in VOCAB.items()}
 DNA_VOCAB = {"A": 0, "T": 1, "C": 2, "G": 3}
 INDEX_TO_DNA = {0: 'A', 1: 'C', 2: 'G', 3: 'T'}
 
+PARALLEL_MIN = 1 << 18  # inputs below this are handled in-process, pool IPC would dominate
+_pool, _pool_workers = None, 0
+
+def default_workers() -> int:
+  """worker count used when none is given, `BIOSAIC_WORKERS` or `cpu_count() - 2`"""
+  env = os.environ.get("BIOSAIC_WORKERS")
+  return max(1, int(env) if env else multiprocessing.cpu_count() - 2)
+
+def worker_pool(n_workers=None) -> ProcessPoolExecutor:
+  """returns the long-lived process pool, it's only recreated when the worker count changes"""
+  global _pool, _pool_workers
+  n_workers = n_workers or default_workers()
+  if _pool is None or _pool_workers != n_workers:
+    shutdown_pool()
+    _pool, _pool_workers = ProcessPoolExecutor(max_workers=n_workers), n_workers
+  return _pool
+
+@atexit.register
+def shutdown_pool():
+  global _pool, _pool_workers
+  if _pool is not None:
+    _pool.shutdown()
+  _pool, _pool_workers = None, 0
+
+def _share(buffer) -> shared_memory.SharedMemory:
+  # one copy into shared memory, workers attach by name instead of receiving pickled slices
+  data = memoryview(buffer).cast("B")
+  shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+  shm.buf[:len(data)] = data
+  return shm
+
+def _spans(n, overlap, n_workers):
+  chunk = max(1, -(-n // n_workers))
+  return [(i, min(n, i + chunk + overlap)) for i in range(0, n, chunk)]
+
+def _count_pairs_array(ids) -> dict:
+  ids = np.asarray(ids, dtype=np.uint64)
+  keys, counts = np.unique((ids[:-1] << np.uint64(32)) | ids[1:], return_counts=True)
+  return {(k >> 32, k & 0xFFFFFFFF): c for k, c in zip(keys.tolist(), counts.tolist())}
+
 def _count_pairs_chunk(ids_chunk):
   return Counter(zip(ids_chunk, ids_chunk[1:]))
 
-def get_stats(ids):
-  n_procs = max(1, multiprocessing.cpu_count() - 2)
-  chunk = max(1, len(ids) // n_procs)
-  futures, total = [], Counter()
-  with ProcessPoolExecutor(max_workers=n_procs) as exe:
-    for i in range(0, len(ids), chunk):
-      sub = ids[i : i + chunk + 1]
-      futures.append(exe.submit(_count_pairs_chunk, sub))
-    for fut in as_completed(futures):
-      total.update(fut.result())
-  return total
+def get_stats(ids, n_workers=None):
+  """counts adjacent id pairs with one vectorized sort, training keeps its own counts in `_PairIndex`
+
+    Args:
+      ids (array('I')|np.ndarray|list): token ids
+      n_workers (int|None): kept for backward compatibility, counting runs in-process
+    Returns:
+      Counter: (left, right) -> count"""
+  return Counter(_count_pairs_array(np.asarray(ids, dtype=np.uint32)))
 
 def _kmer_chunk(start, end, seq, k):
   return [seq[i:i+k] for i in range(start, end - k + 1)]
 
-def get_kmers(seq, kmer_size=4):
+INVALID_KMER = 0xFFFFFFFF  # id of a window that contains a non-ACGT base
+
+def _kmer_id_span(data, kmer_size, offset) -> np.ndarray:
+  codes = base_codes(data)
+  bad = codes == INVALID_CODE
+  codes[bad] = 0
+  ids = kmer_ids(codes, kmer_size, offset, np.uint32)
+  if bad.any():
+    ids[_bad_windows(bad, kmer_size)] = INVALID_KMER
+  return ids
+
+def _kmer_ids_shared(task):
+  src, dst, start, end, kmer_size, offset = task
+  shm_in, shm_out = shared_memory.SharedMemory(name=src), shared_memory.SharedMemory(name=dst)
+  try:
+    out = np.frombuffer(shm_out.buf, dtype=np.uint32, count=end - start, offset=start * 4)
+    out[:] = _kmer_id_span(bytes(shm_in.buf[start:end + kmer_size - 1]), kmer_size, offset)
+    del out
+  finally:
+    shm_in.close()
+    shm_out.close()
+
+def get_kmer_ids(seq, kmer_size=4, offset=0, n_workers=None) -> np.ndarray:
+  """base ids of every overlapping k-mer, `offset + base-4 code` with A=0, C=1, G=2, T=3
+
+    large inputs are split into window ranges that workers write in place into one shared
+    output buffer, so the order is always the window order. there's no tail token: a sequence
+    of n bases gives n - k + 1 ids (none if it's shorter than k), every base is covered by a window
+
+    Args:
+      seq (str|bytes): sequence, lowercase is accepted
+      kmer_size (int): size of the k-mers
+      offset (int): id of 'A' * kmer_size
+      n_workers (int|None): worker processes, defaults to `default_workers()`
+    Returns:
+      np.ndarray: uint32 ids, windows containing a non-ACGT base are `INVALID_KMER`"""
+  data = seq.encode("ascii", errors="replace") if isinstance(seq, str) else bytes(seq)
+  n_workers = n_workers or default_workers()
+  n = len(data) - kmer_size + 1
+  if n <= 0 or n < PARALLEL_MIN or n_workers == 1:
+    return _kmer_id_span(data, kmer_size, offset)
+  shm_in, shm_out = _share(data), shared_memory.SharedMemory(create=True, size=n * 4)
+  try:
+    tasks = [(shm_in.name, shm_out.name, a, b, kmer_size, offset) for a, b in _spans(n, 0, n_workers)]
+    list(worker_pool(n_workers).map(_kmer_ids_shared, tasks))
+    return np.frombuffer(shm_out.buf, dtype=np.uint32, count=n).copy()
+  finally:
+    for shm in (shm_in, shm_out):
+      shm.close()
+      shm.unlink()
+
+def get_kmers(seq, kmer_size=4, n_workers=None):
+  """overlapping k-mer strings plus the legacy `len(seq) % kmer_size` leftover token,
+    training & encoding use `get_kmer_ids` instead, `n_workers` is kept for backward compatibility"""
   seq = seq.upper()
-  n_procs = max(1, multiprocessing.cpu_count() - 2)
-  chunk_size = max(1, len(seq) // n_procs)
-  futures, kmers = [], []
-  with ProcessPoolExecutor(max_workers=n_procs) as exe:
-    for i in range(0, len(seq) - kmer_size + 1, chunk_size):
-      start = i
-      end = min(i + chunk_size + kmer_size - 1, len(seq))
-      futures.append(exe.submit(_kmer_chunk, start, end, seq, kmer_size))
-    for fut in as_completed(futures):
-      kmers.extend(fut.result())
+  kmers = _kmer_chunk(0, len(seq), seq, kmer_size)
 
   # adding leftover token if any (1 to k-1 characters at the end)
   rem = len(seq) % kmer_size
@@ -79,19 +167,310 @@ def batch_merge(ids, merge_map):
     i += 1
   return out
 
+REMOVED = 0xFFFFFFFF  # marks slots of the linked token list that were merged away
+
+def _as_positions(values) -> array:
+  out = array('q')
+  out.frombytes(np.ascontiguousarray(values, dtype=np.int64).tobytes())
+  return out
+
+class _PairIndex:
+  """pair counts plus a position index over a doubly linked token list
+
+    counts are built once, every merge then only touches the neighbours of its own occurrences,
+    so a merge costs time proportional to the number of times the pair occurs
+    record starts (other than 0) break the links, no pair is ever formed across records"""
+  def __init__(self, ids, starts=()):
+    arr = np.asarray(ids, dtype=np.uint32)
+    n = len(arr)
+    nxt, prv = np.arange(1, n + 1, dtype=np.int64), np.arange(-1, n - 1, dtype=np.int64)
+    if n:
+      nxt[-1] = -1
+    cuts = np.asarray([s for s in starts if 0 < s < n], dtype=np.int64)
+    nxt[cuts - 1], prv[cuts] = -1, -1
+    self.ids, self.next, self.prev = array('I', arr.tobytes()), _as_positions(nxt), _as_positions(prv)
+
+    # pair key = left << 32 | right, grouped with one sort instead of a python loop over the corpus
+    left = np.flatnonzero(nxt != -1)
+    keys = (arr[left].astype(np.uint64) << np.uint64(32)) | arr[left + 1]
+    order = np.argsort(keys, kind="stable")
+    keys, positions = keys[order], left[order]
+    uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    self.counts, self.where = {}, {}
+    for key, f, c in zip(uniq.tolist(), first.tolist(), counts.tolist()):
+      pair = (key >> 32, key & 0xFFFFFFFF)
+      self.counts[pair] = c
+      self.where[pair] = _as_positions(positions[f:f + c])
+    self.heap = [(-c, pair) for pair, c in self.counts.items()]
+    heapq.heapify(self.heap)
+
+  def __len__(self):
+    return len(self.counts)
+
+  def most_common(self):
+    """returns the most frequent (pair, count), ties go to the smallest pair, None once nothing is left"""
+    while self.heap:
+      neg, pair = self.heap[0]
+      count = self.counts.get(pair, 0)
+      if count == -neg:
+        return pair, count
+      # stale entry, counts only went down since it was pushed
+      heapq.heapreplace(self.heap, (-count, pair)) if count > 0 else heapq.heappop(self.heap)
+    return None
+
+  def _add(self, pair, delta, pos=None):
+    count = self.counts.get(pair, 0) + delta
+    if count > 0:
+      self.counts[pair] = count
+      if delta > 0:
+        heapq.heappush(self.heap, (-count, pair))
+        self.where.setdefault(pair, array('q')).append(pos)
+    else:
+      self.counts.pop(pair, None)
+      self.where.pop(pair, None)
+
+  def merge(self, pair, new_id):
+    """replaces every occurrence of `pair` (left to right) with `new_id`, returns the number of merges"""
+    a, b = pair
+    ids, nxt, prv = self.ids, self.next, self.prev
+    merged = 0
+    for i in sorted(self.where.pop(pair, ())):
+      j = nxt[i]
+      if ids[i] != a or j == -1 or ids[j] != b:
+        continue  # stale position, or already consumed by an overlapping occurrence
+      p, q = prv[i], nxt[j]
+      if p != -1:
+        self._add((ids[p], a), -1)
+      if q != -1:
+        self._add((b, ids[q]), -1)
+      ids[i], ids[j] = new_id, REMOVED
+      nxt[i] = q
+      if q != -1:
+        prv[q] = i
+      if p != -1:
+        self._add((ids[p], new_id), 1, p)
+      if q != -1:
+        self._add((new_id, ids[q]), 1, i)
+      merged += 1
+    self.counts.pop(pair, None)
+    return merged
+
+  def tokens(self) -> array:
+    """current token ids in order, records concatenated"""
+    arr = np.frombuffer(self.ids, dtype=np.uint32)
+    return array('I', arr[arr != REMOVED].tobytes())
+
+  def snapshot(self):
+    """compacted (ids, record starts), enough to rebuild an identical index"""
+    arr = np.frombuffer(self.ids, dtype=np.uint32)
+    alive = arr != REMOVED
+    heads = alive & (np.frombuffer(self.prev, dtype=np.int64) == -1)
+    # the first token of a record is never merged away, so its rank among live tokens is its new position
+    return arr[alive], (np.cumsum(alive) - 1)[heads]
+
+  def pair_counts(self) -> np.ndarray:
+    """(left, right, count) rows sorted by pair"""
+    rows = np.array([(a, b, c) for (a, b), c in self.counts.items()], dtype=np.uint64).reshape(-1, 3)
+    return rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+
+def apply_merges(ids, ranks) -> list:
+  """applies learned merges to a list of ids, lowest rank first & left to right within a rank,
+    which replays training exactly: merging a pair only creates pairs with a higher rank
+
+    Args:
+      ids (Iterable[int]): base token ids
+      ranks (dict): (left, right) -> (rank, new_id)
+    Returns:
+      List[int]: merged ids"""
+  ids = list(ids)
+  n = len(ids)
+  nxt, prv = list(range(1, n + 1)), list(range(-1, n - 1))
+  heap = [(ranks[pair][0], i) for i, pair in enumerate(zip(ids, ids[1:])) if pair in ranks]
+  heapq.heapify(heap)
+  while heap:
+    rank, i = heapq.heappop(heap)
+    j = nxt[i]
+    if ids[i] is None or j >= n:
+      continue
+    hit = ranks.get((ids[i], ids[j]))
+    if hit is None or hit[0] != rank:
+      continue  # stale entry, one side was merged away since it was pushed
+    ids[i], ids[j] = hit[1], None
+    nxt[i] = q = nxt[j]
+    if q < n:
+      prv[q] = i
+    p = prv[i]
+    if p >= 0 and (ids[p], ids[i]) in ranks:
+      heapq.heappush(heap, (ranks[ids[p], ids[i]][0], p))
+    if q < n and (ids[i], ids[q]) in ranks:
+      heapq.heappush(heap, (ranks[ids[i], ids[q]][0], i))
+  return [i for i in ids if i is not None]
+
+def _iter_segments(path, kmer_size, offset, chunk_bytes):
+  # yields (starts_new_segment, ids), a segment is a run of clean k-mers inside one record
+  carry, open_segment = b"", False
+  for bases in _iter_bases(path, chunk_bytes):
+    if bases is None:
+      carry, open_segment = b"", False
+      continue
+    seq = carry + bases
+    codes = base_codes(seq)
+    bad = codes == INVALID_CODE
+    codes[bad] = 0
+    ids = kmer_ids(codes, kmer_size, offset, np.uint32)
+    if len(ids):
+      starts, ends = _good_runs(_bad_windows(bad, kmer_size))
+      for a, b in zip(starts.tolist(), ends.tolist()):
+        yield not (a == 0 and open_segment), ids[a:b]
+      open_segment = bool(len(ends)) and ends[-1] == len(ids)
+    carry = seq[max(0, len(seq) - kmer_size + 1):] if kmer_size > 1 else b""
+
+def read_records(paths, kmer_size, offset=0, chunk_bytes=1 << 24) -> RaggedIds:
+  """reads FASTA/plain-text files into an arena of k-mer ids, one flat uint32 buffer plus offsets
+
+    every record becomes its own segment & ambiguous bases (e.g. `N`) split a record into
+    several segments, so no id pair ever spans two records or an unknown base
+    trailing bases shorter than a k-mer are dropped
+
+    Args:
+      paths (str|List[str]): FASTA or plain-text files, optionally gzipped
+      kmer_size (int): size of the base k-mers
+      offset (int): id of 'A' * kmer_size
+      chunk_bytes (int): number of bytes read per chunk
+    Returns:
+      RaggedIds: one row per segment"""
+  ids, starts = array('I'), array('q')
+  for path in [paths] if isinstance(paths, (str, os.PathLike)) else paths:
+    for new_segment, chunk in _iter_segments(path, kmer_size, offset, chunk_bytes):
+      if new_segment:
+        starts.append(len(ids))
+      ids.frombytes(chunk.tobytes())
+  starts.append(len(ids))
+  return RaggedIds(np.frombuffer(ids, dtype=np.uint32), np.frombuffer(starts, dtype=np.int64))
+
+def sample_records(records:RaggedIds, fraction:float, seed:int=0) -> RaggedIds:
+  """keeps a random `fraction` of the rows of an arena, whole rows only"""
+  keep = np.random.default_rng(seed).random(len(records)) < fraction
+  lengths = records.lengths
+  offsets = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+  np.cumsum(lengths[keep], out=offsets[1:])
+  return RaggedIds(records.ids[np.repeat(keep, lengths)], offsets)
+
+def compare_merges(approx, exact) -> dict:
+  """divergence between two merge lists, given as merged token strings in merge order
+
+    Returns:
+      dict: `prefix` (merges identical from the start), `overlap` (share of exact tokens also learned
+        approximately), `jaccard` of both token sets & `rank_shift` (mean rank distance of shared tokens)"""
+  approx, exact = list(approx), list(exact)
+  prefix = next((i for i, (a, b) in enumerate(zip(approx, exact)) if a != b), min(len(approx), len(exact)))
+  rank_a, rank_b = {t: i for i, t in enumerate(approx)}, {t: i for i, t in enumerate(exact)}
+  shared = rank_a.keys() & rank_b.keys()
+  union = rank_a.keys() | rank_b.keys()
+  return {
+    "prefix": prefix,
+    "overlap": len(shared) / len(rank_b) if rank_b else 1.0,
+    "jaccard": len(shared) / len(union) if union else 1.0,
+    "rank_shift": sum(abs(rank_a[t] - rank_b[t]) for t in shared) / len(shared) if shared else 0.0,
+  }
+
+def _pair_keys(ids, head):
+  # left << 32 | right for every adjacent pair, pairs across record starts can't match any real key
+  keys = (ids[:-1].astype(np.uint64) << np.uint64(32)) | ids[1:]
+  keys[head[1:]] = np.uint64(REMOVED) << np.uint64(32) | np.uint64(REMOVED)
+  return keys
+
+def _count_keys(ids, head, candidates) -> np.ndarray:
+  """exact counts of just the `candidates` (sorted pair keys) in one vectorized pass, no position index"""
+  keys = _pair_keys(ids, head)
+  slot = np.minimum(np.searchsorted(candidates, keys), len(candidates) - 1)
+  hit = candidates[slot] == keys
+  return np.bincount(slot[hit], minlength=len(candidates))
+
+def _merge_array(ids, head, pair, new_id):
+  """merges every occurrence of `pair` left to right, like `_PairIndex.merge`, returns new (ids, head)"""
+  a, b = pair
+  hits = np.flatnonzero((ids[:-1] == a) & (ids[1:] == b) & ~head[1:])
+  if a == b and len(hits):
+    # runs of the same id: only every other position of a run of overlapping hits is merged
+    run_start = np.flatnonzero(np.diff(hits, prepend=-2) != 1)
+    within = np.arange(len(hits)) - np.repeat(run_start, np.diff(np.append(run_start, len(hits))))
+    hits = hits[within % 2 == 0]
+  ids = ids.copy()
+  ids[hits] = new_id
+  keep = np.ones(len(ids), dtype=bool)
+  keep[hits + 1] = False
+  return ids[keep], head[keep]
+
+class _Checkpointer:
+  """writes training checkpoints to a directory from a background thread
+
+    layout: `ids-<n>.u32` (raw memmap-able token ids), `starts-<n>.npy`, `pairs-<n>.npy` and
+    `state.json`, which is replaced last & atomically, so a crash mid-write keeps the previous checkpoint"""
+  def __init__(self, path, every):
+    self.path, self.every = path, every
+    self.last, self._thread = timeit.default_timer(), None
+    os.makedirs(path, exist_ok=True)
+
+  def due(self):
+    return timeit.default_timer() - self.last >= self.every
+
+  def save(self, trainer, index, vocab_size, wait=False):
+    # only the snapshot happens on the training thread, the disk writes overlap the next merges
+    ids, starts = index.snapshot()
+    state = {"kmer_size": trainer.kmer_size, "continuous": trainer.continuous, "vocab_size": vocab_size,
+             "merges": [list(m) for m in trainer.merges], "n_tokens": len(ids), "tag": len(trainer.merges)}
+    self.wait()
+    self._thread = threading.Thread(target=self._write, args=(state, ids, starts, index.pair_counts()), daemon=True)
+    self._thread.start()
+    self.last = timeit.default_timer()
+    if wait:
+      self.wait()
+
+  def wait(self):
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def _write(self, state, ids, starts, pairs):
+    with metrics.phase("io"):
+      self._write_files(state, ids, starts, pairs)
+    metrics.emit("checkpoint", merges=state["tag"], path=self.path)
+    logger.info("checkpoint: %d merges saved to %s", state["tag"], self.path)
+
+  def _write_files(self, state, ids, starts, pairs):
+    tag, state_path = state["tag"], os.path.join(self.path, "state.json")
+    ids.tofile(os.path.join(self.path, f"ids-{tag}.u32"))
+    np.save(os.path.join(self.path, f"starts-{tag}.npy"), starts)
+    np.save(os.path.join(self.path, f"pairs-{tag}.npy"), pairs)
+    old = _read_state(self.path).get("tag") if os.path.isfile(state_path) else None
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+      json.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+    if old is not None and old != tag:
+      for name in (f"ids-{old}.u32", f"starts-{old}.npy", f"pairs-{old}.npy"):
+        os.remove(os.path.join(self.path, name))
+
+def _read_state(path):
+  with open(os.path.join(path, "state.json"), "r", encoding="utf-8") as f:
+    return json.load(f)
+
 class bpe_trainer:
-  def __init__(self, kmer_size, continuous=False):
+  def __init__(self, kmer_size, continuous=False, n_workers=None):
     self.init_vocab_size = len(DNA_VOCAB)
     self.kmer_size = kmer_size
+    self.continuous = continuous
+    self.n_workers = n_workers  # None -> `default_workers()`
     self.base_vocab = {}
     self.vocab = {}
+    self.merges = []  # (left, right, new_id) in merge order
+    self.report = None  # exact verification of an approximate run
     self.initialize_vocab(continuous)
 
   def __str__(self):
     return f"\t/Biosaic BPE trainer v0.1/\t"
 
   def initialize_vocab(self, continuous=False):
-    print("DEBUGG INFO[101] Intializing Vocabs")
     letters = sorted(DNA_VOCAB.keys())
     combos = []
     if continuous:
@@ -102,7 +481,7 @@ class bpe_trainer:
     self.base_vocab = {''.join(c): i for i, c in enumerate(combos)}
     self.init_vocab_size = len(self.base_vocab)
     self.vocab = {v: k for k, v in self.base_vocab.items()}
-    print(f"DEBUGG INFO[201] Vocabs Initialized successfully for K_Mer size of {self.kmer_size}")
+    logger.debug("initialized %d base tokens for k-mer size %d", self.init_vocab_size, self.kmer_size)
 
   def _base_encode(self, tokens):
     arr = array('I')
@@ -110,80 +489,234 @@ class bpe_trainer:
       arr.append(self.base_vocab.get(t, 0))
     return arr
 
-  def train(self, seq, vocab_size, early_stop=10):
-    print(f"DEBUGG INFO[106] Starting the training with target_vocab: {vocab_size}, early_stopping: {early_stop}")
+  def train(self, seq, vocab_size, early_stop=10, checkpoint=None, checkpoint_every=600.0):
+    """learns `vocab_size - init_vocab_size` merges, one at a time & exactly
+
+    Args:
+      seq (str): training sequence
+      vocab_size (int): target vocab size
+      early_stop (int): kept for backward compatibility, merges are no longer applied in batches
+      checkpoint (str|None): directory for periodic checkpoints, see `bpe_trainer.resume`
+      checkpoint_every (float): seconds between two checkpoints
+    """
+    logger.info("training started, target vocab: %d", vocab_size)
+    with metrics.phase("kmers"):
+      ids = get_kmer_ids(seq, self.kmer_size, self.base_vocab["A" * self.kmer_size], self.n_workers)
+      # ambiguous windows are dropped & split the sequence, no pair spans them
+      starts, ends = _good_runs(ids == INVALID_KMER)
+      starts = np.concatenate(([0], np.cumsum(ends - starts)[:-1])).tolist()
+      ids = ids[ids != INVALID_KMER]
+    metrics.count("tokens", len(ids))
+    logger.info("%d k-mers of length %d", len(ids), self.kmer_size)
+    self._train_ids(ids, vocab_size, starts, checkpoint=checkpoint, checkpoint_every=checkpoint_every)
+
+  def train_from_files(self, paths, vocab_size, chunk_bytes=1 << 24, sample=None, verify_top=100, seed=0,
+                       checkpoint=None, checkpoint_every=600.0):
+    """trains on FASTA records without ever joining them into one string
+
+    Args:
+      paths (str|List[str]): FASTA or plain-text files, optionally gzipped
+      vocab_size (int): target vocab size
+      chunk_bytes (int): number of bytes read per chunk
+      sample (float|None): approximate mode, merges are learned on this fraction of the records
+      verify_top (int): approximate mode, the first `verify_top` merges are re-ranked by their exact
+        counts over all records, the divergence summary is kept in `self.report`
+      seed (int): seed of the record sample
+      checkpoint (str|None): directory for periodic checkpoints, see `bpe_trainer.resume`
+      checkpoint_every (float): seconds between two checkpoints
+    """
+    logger.info("training started, target vocab: %d", vocab_size)
+    with metrics.phase("io"):
+      records = read_records(paths, self.kmer_size, self.base_vocab["A" * self.kmer_size], chunk_bytes)
+    metrics.count("tokens", len(records.ids))
+    logger.info("%d segments, %d k-mers of length %d", len(records), len(records.ids), self.kmer_size)
+    if not sample:
+      self._train_ids(records.ids, vocab_size, records.offsets[:-1].tolist(), checkpoint, checkpoint_every)
+      return
+    subset = sample_records(records, sample, seed)
+    logger.info("sampled %d/%d segments, %d tokens", len(subset), len(records), len(subset.ids))
+    self._train_ids(subset.ids, vocab_size, subset.offsets[:-1].tolist(), checkpoint, checkpoint_every)
+    self.report = self.verify_merges(records, verify_top)
+
+  def verify_merges(self, records:RaggedIds, top:int=100, rerank:bool=True) -> dict:
+    """exact pass over the first `top` learned merges: replays them over `records` & re-ranks them by exact counts
+
+      at every step the eligible candidate (both parts already exist) with the highest exact count is
+      merged next, ties keep the learned order; only the candidate pairs are counted (one vectorized pass
+      per step over a flat id array), so memory stays at a few bytes per token, no pair index is built
+
+    Args:
+      records (RaggedIds): base ids of all records, see `read_records`
+      top (int): number of learned merges to check
+      rerank (bool): rewrite `merges`/`vocab` in the exact order, later merges are renumbered to match
+    Returns:
+      dict: `checked`, `agreement` (share of steps where the learned merge had the exact best count),
+        `freq_ratio` (mean exact count of the learned merge relative to the exact best), `first_divergence`
+        & `reordered` (number of merges whose rank changed)"""
+    learned = self.merges[:top]
+    if not learned:
+      report = {"checked": 0, "agreement": 1.0, "freq_ratio": 1.0, "first_divergence": None, "reordered": 0}
+      metrics.emit("verify", **report)
+      return report
+    ids = np.ascontiguousarray(records.ids, dtype=np.uint32)
+    head = np.zeros(len(ids), dtype=bool)
+    head[records.offsets[:-1][records.offsets[:-1] < len(ids)]] = True
+    renamed = {i: i for i in range(self.init_vocab_size)}  # learned id -> id in the exact order
+    remaining, order = list(range(len(learned))), []
+    agree, ratios, first = 0, [], None
+    with metrics.phase("verify"):
+      while remaining:
+        eligible = [c for c in remaining if learned[c][0] in renamed and learned[c][1] in renamed]
+        pairs = [(renamed[learned[c][0]], renamed[learned[c][1]]) for c in eligible]
+        keys = np.array([(x << 32) | y for x, y in pairs], dtype=np.uint64)
+        sort = np.argsort(keys, kind="stable")
+        counts = np.empty(len(keys), dtype=np.int64)
+        counts[sort] = _count_keys(ids, head, keys[sort])
+        pick = int(np.argmax(counts))  # first maximum, so ties keep the learned order
+        # the learned merge at this step is the earliest remaining one, eligible as merges only build on earlier ids
+        step = len(order)
+        if counts[0] == counts[pick]:
+          agree += 1
+        elif first is None:
+          first = step
+        ratios.append(counts[0] / counts[pick] if counts[pick] else 1.0)
+        chosen = eligible[pick]
+        new_id = self.init_vocab_size + step
+        renamed[learned[chosen][2]] = new_id
+        ids, head = _merge_array(ids, head, pairs[pick], new_id)
+        remaining.remove(chosen)
+        order.append(chosen)
+    report = {"checked": len(order), "agreement": agree / len(order), "freq_ratio": float(np.mean(ratios)),
+              "first_divergence": first, "reordered": sum(c != i for i, c in enumerate(order))}
+    if rerank and report["reordered"]:
+      self._rename_merges(renamed)
+    metrics.emit("verify", **report)
+    logger.info("verification: %s", report)
+    return report
+
+  def _rename_merges(self, renamed):
+    # renumbers merges after re-ranking: ids not in `renamed` (merges past the checked ones) keep their value
+    strings = {i: t for t, i in self.vocab.items()}
+    merges = sorted(((renamed.get(a, a), renamed.get(b, b), renamed.get(n, n)) for a, b, n in self.merges), key=lambda m: m[2])
+    self.merges = merges
+    self.vocab = {strings[old]: renamed.get(old, old) for old in strings}
+
+  def merged_tokens(self):
+    """learned token strings in merge order"""
+    by_id = {i: t for t, i in self.vocab.items()}
+    return [by_id[new_id] for _, _, new_id in self.merges]
+
+  @classmethod
+  def resume(cls, checkpoint, vocab_size=None, checkpoint_every=600.0, n_workers=None):
+    """continues a checkpointed run exactly where it stopped
+
+    Args:
+      checkpoint (str): checkpoint directory written by `train`/`train_from_files`
+      vocab_size (int|None): target vocab size, defaults to the one of the original run
+      checkpoint_every (float): seconds between two checkpoints
+    Returns:
+      bpe_trainer: trained instance
+    """
+    state = _read_state(checkpoint)
+    tag = state["tag"]
+    trainer = cls(state["kmer_size"], state["continuous"], n_workers)
+    for a, b, new_id in state["merges"]:
+      trainer.vocab[new_id] = trainer.vocab[a] + trainer.vocab[b]
+      trainer.merges.append((a, b, new_id))
+    ids = np.memmap(os.path.join(checkpoint, f"ids-{tag}.u32"), dtype=np.uint32, mode="r", shape=(state["n_tokens"],)) \
+      if state["n_tokens"] else np.empty(0, dtype=np.uint32)
+    starts = np.load(os.path.join(checkpoint, f"starts-{tag}.npy")).tolist()
+    index = _PairIndex(ids, starts)
+    if not np.array_equal(index.pair_counts(), np.load(os.path.join(checkpoint, f"pairs-{tag}.npy"))):
+      raise ValueError(f"checkpoint `{checkpoint}` is corrupted, pair counts don't match the saved ids")
+    logger.info("resuming from %d merges, %d tokens", len(trainer.merges), len(ids))
+    trainer._train_ids(None, vocab_size or state["vocab_size"], checkpoint=checkpoint, checkpoint_every=checkpoint_every, index=index)
+    return trainer
+
+  def _train_ids(self, ids, vocab_size, starts=(), checkpoint=None, checkpoint_every=600.0, index=None):
     num_merges = vocab_size - self.init_vocab_size
-    tokens = get_kmers(seq, self.kmer_size)
-    print(f"DEBUGG INFO[107] Converted sequence into K_mers of length: {self.kmer_size}, total tokens: {len(tokens)}")
-    ids = self._base_encode(tokens)
-    merge_count, invalidated_pairs = 0, set()
-
-    while merge_count < num_merges:
-      t0 = timeit.default_timer()
-      stats = get_stats(ids)
-      for pair in invalidated_pairs:
-        if pair in stats:
-          del stats[pair]
-      t1 = timeit.default_timer()
-      print(f"DEBUGG INFO[102] [Stats] {len(stats)} pairs in {(t1 - t0)*1000:.1f}ms")
-
-      top = [p for p in stats.most_common(early_stop) if p[0] not in invalidated_pairs]
-      if not top:
-        print("DEBUGG WARN[301] No more pairs to merge.")
-        break
+    if index is None:
+      with metrics.phase("stats"):
+        index = _PairIndex(ids, starts)
+    metrics.count("pairs", len(index))
+    logger.info("%d distinct pairs", len(index))
+    saver = _Checkpointer(checkpoint, checkpoint_every) if checkpoint else None
+    verbose, done, start = logger.isEnabledFor(logging.DEBUG), len(self.merges), timeit.default_timer()
 
-      merge_map = {}
-      for pair, freq in top:
-        if merge_count >= num_merges:
-          break
-        new_id = self.init_vocab_size + merge_count
-        token_str = f"{self.vocab.get(pair[0], pair[0])}{self.vocab.get(pair[1], pair[1])}"
-        self.vocab[new_id] = token_str
-        merge_map[pair] = new_id
-        merge_count += 1
-
-      t0 = timeit.default_timer()
-      try:
-        ids = batch_merge(ids, merge_map)
-      except KeyError as e:
-        print(f"DEBUGG ERR[999] Merge failed for pair: {e}. Adding to invalidated cache.")
-        invalidated_pairs.add(e)
-        continue
-      t1 = timeit.default_timer()
-      val = (t1 - t0) * 1000 if (t1 - t0) < 1 else (t1 - t0)
-      unit = "ms" if (t1 - t0) < 1 else "s"
-      print(f"DEBUGG INFO[102] [Batch merge] applied {len(merge_map)} merges in {val:.1f}{unit}")
-
-      for idx, (pair, freq) in enumerate(top, start=merge_count - len(merge_map) + 1):
-        if pair not in merge_map:
-          print(f"DEBUGG WARN[302] Skipping invalid pair {pair}")
-          continue
-        mid = merge_map[pair]
-        print(f"DEBUGG INFO[103] Merging {idx}/{num_merges}: ({pair} -> id {mid}), freq: {freq}")
+    while len(self.merges) < num_merges:
+      best = index.most_common()
+      if best is None:
+        logger.warning("no more pairs to merge, stopped at %d merges", len(self.merges))
+        break
+      pair, freq = best
+      new_id = self.init_vocab_size + len(self.merges)
+      self.vocab[new_id] = f"{self.vocab.get(pair[0], pair[0])}{self.vocab.get(pair[1], pair[1])}"
+      self.merges.append((pair[0], pair[1], new_id))
+      index.merge(pair, new_id)
+      if verbose or metrics.hooks:
+        metrics.emit("merge", step=len(self.merges), total=num_merges, pair=pair, new_id=new_id, freq=freq)
+      if saver and saver.due():
+        metrics.add_time("merge", timeit.default_timer() - start)
+        saver.save(self, index, vocab_size)
+        start = timeit.default_timer()
+    metrics.add_time("merge", timeit.default_timer() - start)
+    metrics.count("merges", len(self.merges) - done)
+    if saver:
+      saver.save(self, index, vocab_size, wait=True)
     self.vocab = {v: k for k, v in self.vocab.items()}
 
-  def save(self, path, as_json=False):
+  def save(self, path, as_json=False, binary=False):
     os.makedirs(os.path.dirname(path), exist_ok=True)
     data = {
       "kmer_size": self.kmer_size,
       "init_vocab_size": self.init_vocab_size,
       "base_vocab": self.base_vocab,
-      "merged_vocab": self.vocab
+      "merged_vocab": self.vocab,
+      "merges": [list(m) for m in self.merges]  # exact merge table, `BPE.encode` replays it
     }
+    if binary:
+      write_vocab(path + ".bin", self.vocab, self.kmer_size, self.merges, self.init_vocab_size)
+      logger.info("vocabulary saved to %s", path + ".bin")
+      return
     if as_json:
       with open(path + ".json", "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2)
     else:
       with open(path + ".model", "wb") as f:
         pickle.dump(data, f)
-    print(f"DEBUGG INFO[104] [Saved] Vocabulary saved to {path + ('.json' if as_json else '.model')}")
+    logger.info("vocabulary saved to %s", path + (".json" if as_json else ".model"))
+
+_worker_tokenizer = None
+
+def _init_encode_worker(kmer_size, base_vocab, ranks):
+  global _worker_tokenizer
+  _worker_tokenizer = BPE(cache_size=0)
+  _worker_tokenizer.kmer_size, _worker_tokenizer.base_vocab, _worker_tokenizer.ranks = kmer_size, base_vocab, ranks
+
+def _encode_worker_chunk(seqs):
+  return _encode_rows(_worker_tokenizer, seqs)
+
+def _encode_rows(tokenizer, seqs) -> RaggedIds:
+  ids, offsets = array('I'), array('q', [0])
+  for seq in seqs:
+    # sequences are encoded one by one, get_kmer_ids stays in-process below `PARALLEL_MIN`
+    ids.extend(tokenizer._encode(seq))
+    offsets.append(len(ids))
+  return RaggedIds(np.frombuffer(ids, dtype=np.uint32), np.frombuffer(offsets, dtype=np.int64))
 
 class BPE:
-  def __init__(self, encodings: str = None):
+  def __init__(self, encodings: str = None, cache_size: int = 1 << 20, cache_max_len: int = 1 << 12):
     self.vocab = {}       # final merged vocabulary; keys are merged token strings, values are IDs
     self.inv_vocab = {}   # reverse mapping: ID -> token string
     self.base_vocab = {}  # base vocabulary; keys are base k-mer strings, values are IDs
+    self.merges = []      # (left, right, new_id) in merge order
+    self.ranks = {}       # (left, right) -> (rank, new_id)
     self.kmer_size = None
+    # LRU of encoded short sequences (reads, repeated windows), bounded by the total number of cached ids;
+    # longer inputs such as contigs are never cached, they'd evict everything & rarely repeat
+    self.cache_size, self.cache_max_len = cache_size, cache_max_len
+    self._cache, self._cached_ids = OrderedDict(), 0
+    self._emitted, self._emitted_offsets, self._tails = np.empty(0, dtype=np.uint8), np.zeros(1, dtype=np.int64), []
     if encodings:
       self.load(encodings)
 
@@ -197,77 +730,143 @@ class BPE:
       arr.append(self.base_vocab.get(t, 0))
     return arr
 
+  def _base_ids(self, seq):
+    # same base ids as training, windows with an unknown base fall back to id 0
+    ids = get_kmer_ids(seq, self.kmer_size, self.base_vocab.get("A" * self.kmer_size, 0))
+    ids[ids == INVALID_KMER] = 0
+    return ids.tolist()
+
   def load(self, model_path: str):
-    import os, json, pickle
-    if model_path.endswith(".json"):
-      with open(model_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    elif model_path.endswith(".model"):
-      with open(model_path, "rb") as f:
-        data = pickle.load(f)
+    with metrics.phase("io"):
+      self._load(model_path)
+    logger.info("vocab loaded with %d tokens", len(self.vocab))
+
+  def _load(self, model_path):
+    if model_path.endswith(".bin"):
+      table = VocabFile(model_path)
+      self.vocab, self.kmer_size = table.to_dict(), table.kmer_size
+      self.base_vocab = {t: i for t, i in self.vocab.items() if i < table.init_vocab_size}
+      self.merges = [tuple(m) for m in table.merges.tolist()]
+      table.close()
+    elif model_path.endswith(".json") or model_path.endswith(".model"):
+      data = read_legacy(model_path)
+      self.vocab = data["merged_vocab"]
+      self.base_vocab = data["base_vocab"]
+      self.kmer_size = data.get("kmer_size", None)
+      if "merges" in data:
+        self.merges = [tuple(m) for m in data["merges"]]
+      else:  # older files only kept the merged strings
+        self.merges = infer_merges(self.vocab, data.get("init_vocab_size", len(self.base_vocab)), self.kmer_size)
     else:
-      raise TypeError("Only supports vocab file format `.model` & `.json`")
-    self.vocab = data["merged_vocab"]
-    self.base_vocab = data["base_vocab"]
-    self.kmer_size = data.get("kmer_size", None)
+      raise TypeError("Only supports vocab file format `.model`, `.json` & `.bin`")
     self.inv_vocab = {v: k for k, v in self.vocab.items()}
-    print(f"DEBUGG INFO[201] Vocab loaded successfully with {len(self.vocab)} tokens")
+    self.ranks = {(a, b): (rank, new_id) for rank, (a, b, new_id) in enumerate(self.merges)}
+    self._cache.clear()
+    self._cached_ids = 0
+    self._build_decode_table()
 
   def encode(self, seq: str) -> list[int]:
-    # tokenize the input using get_kmers (which should produce overlapping k-mers)
-    tokens = get_kmers(seq, self.kmer_size)  # tokens is a list of strings
-    # ids = self._base_encode(tokens)
-    # iteratively merge adjacent tokens if possible.
-    # merge rule: for adjacent tokens (a, b), candidate = a + (b[-1])
-    # only merge if candidate exists in self.vocab.
-    while True:
-      merged = []
-      i = 0
-      changed = False
-      while i < len(tokens):
-        # if there's a neighbor, consider merging token[i] with token[i+1]
-        if i < len(tokens) - 1:
-          candidate = tokens[i] + tokens[i+1][-1]
-          if candidate in self.vocab:
-            merged.append(candidate)
-            i += 2
-            changed = True
-            continue
-        # otherwise, just pass the token along unchanged
-        merged.append(tokens[i])
-        i += 1
-      # if no merges occurred in this pass, we're done
-      if not changed:
-        break
-      tokens = merged
-    # finally, convert the merged tokens to their IDs
-    output_ids = []
-    for token in tokens:
-      if token in self.vocab:
-        output_ids.append(self.vocab[token])
-      elif token in self.base_vocab:
-        output_ids.append(self.base_vocab[token])
-      else:
-        output_ids.append(0)  # Fallback for unknown tokens.
+    """encodes a sequence by replaying the learned merges in rank order over the k-mer ids,
+      repeated short sequences (up to `cache_max_len` bases) are served from an LRU cache holding at most `cache_size` ids"""
+    start = timeit.default_timer()
+    output_ids = self._encode(seq)
+    metrics.add_time("encode", timeit.default_timer() - start)
+    metrics.count("encoded_tokens", len(output_ids))
+    return output_ids
+
+  def _encode(self, seq):
+    cacheable = self.cache_size and len(seq) <= self.cache_max_len
+    if cacheable:
+      cached = self._cache.get(seq)
+      if cached is not None:
+        self._cache.move_to_end(seq)
+        return cached.tolist()
+    output_ids = apply_merges(self._base_ids(seq), self.ranks)
+    if cacheable and len(output_ids) <= self.cache_size:
+      self._cache[seq] = np.array(output_ids, dtype=np.uint32)  # 4 bytes per id instead of a tuple of ints
+      self._cached_ids += len(output_ids)
+      while self._cached_ids > self.cache_size:
+        self._cached_ids -= len(self._cache.popitem(last=False)[1])
     return output_ids
 
-  def decode(self, ids: list[int] | list) -> str:
-    # convert token IDs back to token strings
-    tokens = [self.inv_vocab.get(i, "") for i in ids]
-    if not tokens or tokens[0] == "":
+  def encode_batch(self, seqs, n_workers: int = 1, chunks_per_worker: int = 4) -> RaggedIds:
+    """encodes many sequences, rows come back in input order
+
+    Args:
+      seqs (List[str]): sequences to encode
+      n_workers (int): worker processes, they receive the merge tables once at startup
+      chunks_per_worker (int): contiguous slices of `seqs` handed to each worker
+    Returns:
+      RaggedIds: flat uint32 ids plus row offsets
+    """
+    seqs = list(seqs)
+    with metrics.phase("encode"):
+      batch = self._encode_batch(seqs, n_workers, chunks_per_worker)
+    metrics.count("encoded_tokens", len(batch.ids))
+    return batch
+
+  def _encode_batch(self, seqs, n_workers, chunks_per_worker):
+    if n_workers <= 1 or len(seqs) < 2:
+      return _encode_rows(self, seqs)
+    step = max(1, -(-len(seqs) // (n_workers * chunks_per_worker)))
+    state = (self.kmer_size, self.base_vocab, self.ranks)
+    # a dedicated pool: forked workers inherit the tables instead of unpickling them per task
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_encode_worker, initargs=state) as exe:
+      parts = list(exe.map(_encode_worker_chunk, [seqs[i:i + step] for i in range(0, len(seqs), step)]))
+    return RaggedIds.concat(parts, dtype=np.uint32)
+
+  def encode_records(self, path):
+    """encodes a FASTA/FASTQ file (optionally gzipped) record by record
+
+    Yields:
+      Tuple[str, List[int]]: record header & its token ids
+    """
+    for header, seq in read_sequences(path):
+      yield header, self.encode(bytes(seq).decode("ascii", errors="replace"))
+
+  def _build_decode_table(self):
+    # a token spells one overlapping k-mer per position, so in a sequence it only emits the first
+    # base of each of them (`token[0::k]`), the last token of a sequence adds its last k-1 bases
+    k = self.kmer_size or 1
+    n = max(self.inv_vocab, default=-1) + 1
+    emitted, self._tails = [b""] * n, [""] * n
+    for i, token in self.inv_vocab.items():
+      if len(token) % k == 0:
+        emitted[i], self._tails[i] = token[0::k].encode("ascii"), token[len(token) - k + 1:]
+      else:
+        emitted[i] = token.encode("ascii")  # shorter base tokens of continuous vocabs
+    self._emitted = np.frombuffer(b"".join(emitted), dtype=np.uint8)
+    self._emitted_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in emitted], out=self._emitted_offsets[1:])
+
+  def decode(self, ids) -> str:
+    """rebuilds the sequence with one byte gather over the per-id emitted table
+
+    Args:
+      ids (List[int]|np.ndarray|torch.Tensor): 1-D ids, unknown ids decode to nothing
+    Returns:
+      str: decoded sequence
+    """
+    arr = as_id_array(ids).astype(np.int64, copy=False).ravel()
+    arr = arr[(arr >= 0) & (arr < len(self._tails))]
+    if not len(arr):
       return ""
-    # reconstruct the string by stitching together tokens using maximum overlap
-    result = tokens[0]
-    k = self.kmer_size or len(tokens[0])
-    for i in range(1, len(tokens)):
-      max_overlap = 0
-      # check overlap from 1 to k characters
-      max_range = min(len(tokens[i-1]), len(tokens[i]), k)
-      for j in range(1, max_range+1):
-        if tokens[i-1][-j:] == tokens[i][:j]:
-          max_overlap = j
-      result += tokens[i][max_overlap:]
-    return result
+    starts = self._emitted_offsets[arr]
+    lengths = self._emitted_offsets[arr + 1] - starts
+    out_starts = np.cumsum(lengths) - lengths
+    gather = np.repeat(starts - out_starts, lengths) + np.arange(int(lengths.sum()), dtype=np.int64)
+    return self._emitted[gather].tobytes().decode("ascii") + self._tails[arr[-1]]
+
+  def decode_batch(self, ids):
+    """decodes a batch of id rows
+
+    Args:
+      ids (np.ndarray|torch.Tensor|RaggedIds|List[List[int]]): 2-D ids of shape (B, L) or ragged rows
+    Returns:
+      List[str]: one decoded sequence per row
+    """
+    rows = ids if isinstance(ids, (RaggedIds, list)) else as_id_array(ids)
+    return [self.decode(row) for row in rows]
 
   def token_to_id(self, token: str) -> int:
     return self.vocab.get(token, self.base_vocab.get(token, 0))
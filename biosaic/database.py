@@ -1,7 +1,9 @@
 import os, time
-from Bio import Entrez, SeqIO
+from .metrics import logger
+# Bio.Entrez is imported inside the helpers, so `import biosaic` doesn't pay for Biopython
 
 def search_ncbi(query, db='nucleotide', retmax=10000, email=None, api_key=None):
+  from Bio import Entrez
   # configuring Entrez
   if email:
     Entrez.email = email
@@ -15,6 +17,7 @@ def search_ncbi(query, db='nucleotide', retmax=10000, email=None, api_key=None):
   return record.get('IdList', [])
 
 def fetch_and_save(ids, db='nucleotide', out_dir='sequences', batch_size=500, format='fasta'):
+  from Bio import Entrez, SeqIO
   os.makedirs(out_dir, exist_ok=True)
   for start in range(0, len(ids), batch_size):
     batch_ids = ids[start:start+batch_size]
@@ -26,7 +29,7 @@ def fetch_and_save(ids, db='nucleotide', out_dir='sequences', batch_size=500, fo
     SeqIO.write(records, out_path, format)
     handle.close()
 
-    print(f'Saved {len(batch_ids)} records to {out_path}')
+    logger.info('Saved %s records to %s', len(batch_ids), out_path)
     time.sleep(0.4)  # NCBI recommends <= 3 requests/sec
 
 def get_database(query, output_dir, db="nucleotide", retmax=10000, email=None, api_key=None, batch_size=500):
@@ -41,5 +44,5 @@ def get_database(query, output_dir, db="nucleotide", retmax=10000, email=None, a
       batch_size (int, optional): Number of sequences per file. Defaults to 500.
   """
   ids = search_ncbi(query, db=db, retmax=retmax, email=email, api_key=api_key)  # :contentReference[oaicite:0]{index=0}
-  print(f'Found {len(ids)} sequence IDs for query: {query}')
+  logger.info('Found %s sequence IDs for query: %s', len(ids), query)
   fetch_and_save(ids, db=db, out_dir=output_dir, batch_size=batch_size)  # :contentReference[oaicite:1]{index=1}
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""
+  @fasta.py
+    * dependency-free FASTA/FASTQ reader, replaces Bio.SeqIO for bulk processing
+     - plain files are `mmap`ed & parsed with `find`, `.gz` files are decompressed in bounded chunks
+     - yields (header, sequence) with the sequence as a memoryview, line breaks removed with one
+       `bytes.translate` per record (single-line records are zero-copy views into the mmap)
+    * views into the mmap are only valid until the generator finishes, use `bytes(seq)` to keep one
+    * `FastaIndex`: `.fai`-style index for random access to records & regions of plain FASTA files"""
+
+import os, gzip, mmap
+
+_NEWLINES = b"\r\n"
+
+def _open_buffer(path):
+  # returns (buffer, closer) for plain files, None for gzipped ones
+  if str(path).endswith(".gz"):
+    return None
+  f = open(path, "rb")
+  try:
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  except ValueError:  # empty file, nothing to map
+    f.close()
+    return b"", lambda: None
+  def close():
+    try:
+      buf.close()
+    except BufferError:
+      pass  # a caller still holds a sequence view, the mapping goes away with it
+    f.close()
+  return buf, close
+
+def _sequence(buf, start, end):
+  while end > start and buf[end - 1] in _NEWLINES:
+    end -= 1  # trailing line break, so single-line records stay zero-copy
+  view = memoryview(buf)[start:end]
+  if buf.find(b"\n", start, end) < 0 and buf.find(b"\r", start, end) < 0:
+    return view
+  return memoryview(bytes(view).translate(None, _NEWLINES))
+
+def _header(buf, start, end):
+  return bytes(buf[start:end]).decode("utf-8", errors="replace").rstrip("\r")
+
+def _parse_fasta(buf, pos, end, final):
+  # yields (header, sequence, next_pos) for every complete record in buf[pos:end]
+  while pos < end:
+    if buf[pos:pos + 1] != b">":
+      nxt = buf.find(b"\n>", pos, end)
+      if nxt < 0:
+        return
+      pos = nxt + 1
+      continue
+    line_end = buf.find(b"\n", pos, end)
+    nxt = buf.find(b"\n>", pos, end) if line_end >= 0 else -1
+    if nxt < 0 and not final:
+      return
+    seq_end = end if nxt < 0 else nxt + 1
+    if line_end < 0:
+      line_end = end
+    yield _header(buf, pos + 1, line_end), _sequence(buf, min(line_end + 1, seq_end), seq_end), seq_end
+    pos = seq_end
+
+def _parse_fastq(buf, pos, end, final):
+  # 4-line records: @header, sequence, +, quality
+  while pos < end:
+    if buf[pos:pos + 1] in (b"\n", b"\r"):
+      pos += 1  # blank lines between records
+      continue
+    lines, cursor = [], pos
+    while len(lines) < 4 and cursor <= end:
+      nl = buf.find(b"\n", cursor, end)
+      if nl < 0:
+        if not final:
+          return
+        nl = end
+      lines.append((cursor, nl))
+      cursor = nl + 1
+    if len(lines) < 4 or buf[pos:pos + 1] != b"@":
+      raise ValueError(f"malformed FASTQ record at byte {pos}")
+    (h0, h1), (s0, s1), _, (q0, q1) = lines
+    if len(buf[s0:s1].rstrip(b"\r")) != len(buf[q0:q1].rstrip(b"\r")):
+      raise ValueError(f"FASTQ record at byte {pos} has a quality line of the wrong length")
+    pos = min(cursor, end)
+    yield _header(buf, h0 + 1, h1), _sequence(buf, s0, s1), pos
+
+def _read(path, parse, chunk_bytes):
+  opened = _open_buffer(path)
+  if opened is not None:
+    buf, close = opened
+    try:
+      for header, seq, _ in parse(buf, 0, len(buf), True):
+        yield header, seq
+    finally:
+      close()
+    return
+  # gzip: parse complete records out of a bounded rolling buffer
+  with gzip.open(path, "rb") as f:
+    pending = b""
+    while True:
+      data = f.read(chunk_bytes)
+      buf = pending + data
+      pos = 0
+      for header, seq, pos in parse(buf, 0, len(buf), not data):
+        yield header, seq
+      pending = buf[pos:]
+      if not data:
+        return
+
+def read_fasta(path, chunk_bytes:int=1 << 24):
+  """yields (header, sequence) for every FASTA record
+
+  Args:
+    path (str): FASTA file, optionally gzipped
+    chunk_bytes (int): decompressed bytes read per step for `.gz` input
+  Yields:
+    Tuple[str, memoryview]: header without the leading `>` & the sequence bytes
+  """
+  return _read(path, _parse_fasta, chunk_bytes)
+
+def read_fastq(path, chunk_bytes:int=1 << 24):
+  """yields (header, sequence) for every 4-line FASTQ record, qualities are skipped"""
+  return _read(path, _parse_fastq, chunk_bytes)
+
+def read_sequences(path, chunk_bytes:int=1 << 24):
+  """FASTA or FASTQ reader, picked from the first byte of the file (`>` or `@`)"""
+  opener = gzip.open if str(path).endswith(".gz") else open
+  with opener(path, "rb") as f:
+    first = f.read(1)
+  return read_fastq(path, chunk_bytes) if first == b"@" else read_fasta(path, chunk_bytes)
+
+class FastaIndex:
+  """`.fai`-style index of a plain FASTA file, gives random access to any region through `mmap`
+
+    every record is stored as (length, offset, line_bases, line_width) like `samtools faidx`:
+    sequence length, byte offset of its first base, bases per line & bytes per line (with the line break)
+
+    Args:
+      path (str): uncompressed FASTA file
+      index_path (str|None): index file, defaults to `<path>.fai`, built with one linear scan if missing or stale
+  """
+  def __init__(self, path:str, index_path:str=None):
+    if str(path).endswith(".gz"):
+      raise ValueError("random access needs an uncompressed FASTA file")
+    self.path, self.index_path = path, index_path or path + ".fai"
+    if os.path.isfile(self.index_path) and os.path.getmtime(self.index_path) >= os.path.getmtime(path):
+      self.records = _read_fai(self.index_path)
+    else:
+      self.records = build_index(path, self.index_path)
+    self._file, self._mmap = open(path, "rb"), None
+    if os.path.getsize(path):
+      self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def __len__(self):
+    return len(self.records)
+
+  def __contains__(self, name):
+    return name in self.records
+
+  @property
+  def names(self):
+    return list(self.records)
+
+  def length(self, name:str) -> int:
+    return self.records[name][0]
+
+  def fetch(self, name:str, start:int=0, end:int=None) -> bytes:
+    """bases [start, end) of a record (0-based, end exclusive), only the needed bytes are touched"""
+    length, offset, line_bases, line_width = self.records[name]
+    end = length if end is None else min(end, length)
+    start = max(0, start)
+    if start >= end:
+      return b""
+    first = offset + (start // line_bases) * line_width + start % line_bases
+    last = offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases
+    return self._mmap[first:last + 1].translate(None, _NEWLINES)
+
+  def sample(self, n:int, length:int, seed:int=None):
+    """draws `n` random windows of `length` bases, uniform over all valid window positions
+
+    Returns:
+      List[Tuple[str, int, bytes]]: (record name, start, bases)
+    """
+    import numpy as np
+    names = [name for name, rec in self.records.items() if rec[0] >= length]
+    if not names:
+      raise ValueError(f"no record is at least {length} bases long")
+    counts = np.array([self.records[name][0] - length + 1 for name in names], dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, int(counts.sum()), size=n)
+    owners = np.searchsorted(np.cumsum(counts), picks, side="right")
+    starts = picks - (np.cumsum(counts) - counts)[owners]
+    return [(names[i], int(s), self.fetch(names[i], int(s), int(s) + length)) for i, s in zip(owners.tolist(), starts.tolist())]
+
+  def close(self):
+    if self._mmap is not None:
+      self._mmap.close()
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def _read_fai(index_path):
+  records = {}
+  with open(index_path, "r", encoding="utf-8") as f:
+    for line in f:
+      name, length, offset, line_bases, line_width = line.rstrip("\n").split("\t")[:5]
+      records[name] = (int(length), int(offset), int(line_bases), int(line_width))
+  return records
+
+def build_index(path:str, index_path:str=None) -> dict:
+  """scans a FASTA file once & writes a `.fai` index (name, length, offset, line_bases, line_width)
+
+    names are the header up to the first whitespace, every line of a record but its last must
+    have the same length, as random access relies on a fixed line geometry
+
+    Returns:
+      dict: name -> (length, offset, line_bases, line_width)
+  """
+  records = {}
+  with open(path, "rb") as f:
+    name, offset, length, line_bases, line_width, short = None, 0, 0, 0, 0, False
+    pos = 0
+    def close_record():
+      if name is not None:
+        records[name] = (length, offset, line_bases or length, line_width or length)
+    for line in f:
+      if line.startswith(b">"):
+        close_record()
+        header = line[1:].decode("utf-8", errors="replace").split()
+        name = header[0] if header else ""
+        if name in records:
+          raise ValueError(f"duplicate record name `{name}` in {path}")
+        offset, length, line_bases, line_width, short = pos + len(line), 0, 0, 0, False
+      elif name is not None:
+        bases = len(line.rstrip(b"\r\n"))
+        if bases:
+          if short or bases > (line_bases or bases):
+            raise ValueError(f"record `{name}` in {path} has uneven line lengths, it can't be indexed")
+          if not line_bases:
+            line_bases, line_width = bases, len(line)
+          elif len(line) != line_width:
+            short = True  # only the last line of a record may be shorter
+          length += bases
+        elif length:
+          short = True  # blank line, only allowed at the end of a record
+      pos += len(line)
+    close_record()
+  with open(index_path or path + ".fai", "w", encoding="utf-8") as f:
+    for name, (length, offset, line_bases, line_width) in records.items():
+      f.write(f"{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\n")
+  return records
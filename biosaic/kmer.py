@@ -1,28 +1,290 @@
 from itertools import product
 import json, pickle
-import os, io, requests, tempfile, urllib
+import os, gzip, tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from .metrics import logger
+from .fasta import read_sequences
+from .vocabfile import VocabFile, write_vocab, read_legacy, FLAG_CANONICAL
+
+# byte -> 2-bit base code lookup, follows the sorted vocab order (A=0, C=1, G=2, T=3)
+# lower-case bases map to the same codes, everything else is flagged with 255
+_BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate(b"ACGT"):
+  _BASE_CODES[_base] = _BASE_CODES[_base + 32] = _code
+INVALID_CODE = 255
+_CODE_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)  # 2-bit code -> base byte
+
+def id_dtype(n_ids:int):
+  """smallest unsigned dtype that holds `n_ids` distinct ids"""
+  if n_ids <= 1 << 16:
+    return np.uint16
+  return np.uint32 if n_ids <= 1 << 32 else np.uint64
+
+def base_codes(sequence) -> np.ndarray:
+  """maps a sequence (str/bytes) to an array of 2-bit base codes through the byte lookup table"""
+  if isinstance(sequence, str):
+    sequence = sequence.encode("ascii", errors="replace")
+  return _BASE_CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+def as_id_array(ids) -> np.ndarray:
+  """accepts lists, numpy arrays & torch tensors (on any device) of ids"""
+  if hasattr(ids, "detach"):
+    ids = ids.detach().cpu().numpy()
+  return np.asarray(ids)
+
+def kmer_ids(codes:np.ndarray, kmer_size:int, offset:int=0, dtype=None) -> np.ndarray:
+  """rolling 2-bit hash over base codes, returns the id of every overlapping k-mer
+
+  Args:
+    codes (np.ndarray): base codes from `base_codes`, must not contain `INVALID_CODE`
+    kmer_size (int): size of the k-mers
+    offset (int): id of the first k-mer ('A' * kmer_size) in the vocab
+    dtype (optional): output dtype, defaults to the smallest one fitting the id space
+  Returns:
+    np.ndarray: contiguous array of len(codes) - kmer_size + 1 ids
+  """
+  dtype = dtype or id_dtype(offset + 4 ** kmer_size)
+  n = len(codes) - kmer_size + 1
+  if n <= 0:
+    return np.empty(0, dtype=dtype)
+  # shifting in one base per pass keeps every window at 2*k bits, so no extra mask is needed
+  ids = codes[:n].astype(dtype)
+  for j in range(1, kmer_size):
+    ids <<= 2
+    ids |= codes[j:j + n]
+  if offset:
+    ids += offset
+  return ids
+
+def revcomp_ids(ids, kmer_size:int) -> np.ndarray:
+  """reverse complement in the id domain, the complement of a 2-bit code is `3 - code` (A<->T, C<->G)"""
+  ids = np.asarray(ids, dtype=np.int64)
+  rc = np.zeros_like(ids)
+  for j in range(kmer_size):
+    rc = (rc << 2) | (3 - ((ids >> (2 * j)) & 3))
+  return rc
+
+def canonical_table(kmer_size:int, dtype=np.uint32):
+  """maps every base-4 k-mer code to a compact id of min(kmer, revcomp)
+
+  Returns:
+    Tuple[np.ndarray, np.ndarray]: code -> canonical id table (4^k entries) & the canonical codes in id order
+  """
+  codes = np.arange(4 ** kmer_size, dtype=np.int64)
+  canonical, table = np.unique(np.minimum(codes, revcomp_ids(codes, kmer_size)), return_inverse=True)
+  return table.astype(dtype), canonical
+
+class RaggedIds:
+  """compact ragged batch of ids: one flat buffer plus offsets
+    ids of the i-th sequence are `ids[offsets[i]:offsets[i+1]]`"""
+  __slots__ = ("ids", "offsets")
+
+  def __init__(self, ids:np.ndarray, offsets:np.ndarray):
+    self.ids, self.offsets = ids, offsets
+
+  @classmethod
+  def concat(cls, parts, dtype=None):
+    parts = list(parts)
+    if not parts:
+      return cls(np.empty(0, dtype=dtype or np.uint32), np.zeros(1, dtype=np.int64))
+    ids = np.concatenate([p.ids for p in parts])
+    shifts = np.cumsum([0] + [len(p.ids) for p in parts[:-1]])
+    offsets = np.concatenate([parts[0].offsets[:1]] + [p.offsets[1:] + s for p, s in zip(parts, shifts)])
+    return cls(ids, offsets)
+
+  @property
+  def lengths(self) -> np.ndarray:
+    return np.diff(self.offsets)
+
+  def tolist(self):
+    return [self.ids[a:b].tolist() for a, b in zip(self.offsets[:-1], self.offsets[1:])]
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError("Index out of range.")
+    return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def __repr__(self):
+    return f"RaggedIds <n_seqs={len(self)}, n_ids={len(self.ids)}, dtype={self.ids.dtype}>"
+
+def _ragged(arrays, dtype) -> RaggedIds:
+  offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+  np.cumsum([len(a) for a in arrays], out=offsets[1:])
+  ids = np.concatenate(arrays).astype(dtype, copy=False) if arrays else np.empty(0, dtype=dtype)
+  return RaggedIds(ids, offsets)
+
+def _bad_windows(bad:np.ndarray, kmer_size:int) -> np.ndarray:
+  # marks every window of `kmer_size` bases that contains at least one flagged base
+  counts = np.zeros(len(bad) + 1, dtype=np.int64)
+  np.cumsum(bad, out=counts[1:])
+  return (counts[kmer_size:] - counts[:-kmer_size]) > 0 if len(bad) >= kmer_size else np.zeros(0, dtype=bool)
+
+def _good_runs(window_bad:np.ndarray):
+  # start/end (exclusive) of every maximal run of clean windows
+  edges = np.diff(np.concatenate(([0], (~window_bad).view(np.int8), [0])))
+  return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def _encode_batch_chunk(sequences, kmer_size, offset, dtype, unknown="error", unk_id=None, canon=None):
+  # encodes the whole chunk as one joined sequence & keeps only the windows that don't cross a boundary
+  seqs = [s.encode("ascii", errors="replace") if isinstance(s, str) else bytes(s) for s in sequences]
+  lengths = np.fromiter((len(s) for s in seqs), dtype=np.int64, count=len(seqs))
+  counts = np.maximum(lengths - kmer_size + 1, 0)
+  offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+  np.cumsum(counts, out=offsets[1:])
+  codes = base_codes(b"".join(seqs))
+  bad = codes == INVALID_CODE
+  has_bad = bool(bad.any())
+  if has_bad:
+    if unknown == "error":
+      raise ValueError("Invalid character in DNA sequence")
+    codes[bad] = 0
+  starts = np.zeros(len(seqs), dtype=np.int64)
+  np.cumsum(lengths[:-1], out=starts[1:])
+  all_ids = kmer_ids(codes, kmer_size, offset, dtype)
+  if canon is not None:
+    all_ids = canon[all_ids]
+  positions = np.arange(offsets[-1], dtype=np.int64) + np.repeat(starts - offsets[:-1], counts)
+  ids = all_ids[positions]
+  if has_bad:
+    window_bad = _bad_windows(bad, kmer_size)[positions]
+    if unknown == "unk":
+      ids[window_bad] = unk_id
+    else:
+      owners = np.repeat(np.arange(len(seqs)), counts)[~window_bad]
+      ids = ids[~window_bad]
+      offsets[1:] = np.cumsum(np.bincount(owners, minlength=len(seqs)))
+  return RaggedIds(ids, offsets)
+
+_WHITESPACE = b" \t\r\n"
+
+def _iter_bases(path, chunk_bytes):
+  """reads a FASTA or plain-text file in fixed-size chunks & yields the raw bases of each chunk
+    header lines are dropped, `None` is yielded whenever a new FASTA record starts"""
+  opener = gzip.open if str(path).endswith(".gz") else open
+  with opener(path, "rb") as f:
+    at_line_start, in_header = True, False
+    for chunk in iter(lambda: f.read(chunk_bytes), b""):
+      pos, n = 0, len(chunk)
+      while pos < n:
+        if in_header:
+          end = chunk.find(b"\n", pos)
+          if end < 0:
+            break
+          pos, in_header, at_line_start = end + 1, False, True
+        elif at_line_start and chunk[pos] == ord(">"):
+          in_header = True
+          yield None
+        else:
+          # everything up to the next header line is sequence, stripped in bulk
+          end = chunk.find(b"\n>", pos)
+          stop = n if end < 0 else end + 1
+          bases = chunk[pos:stop].translate(None, _WHITESPACE)
+          if bases:
+            yield bases
+          pos, at_line_start = stop, chunk[stop - 1] == ord("\n")
+
+UNKNOWN_POLICIES = ("error", "skip", "split", "unk")
 
 class KMer:
-  def __init__(self, kmer_size:int=4):
+  def __init__(self, kmer_size:int=4, unknown:str="error", canonical:bool=False):
+    """
+      Args:
+        kmer_size (int): size of the k-mers
+        unknown (str): how k-mers with non-ACGT symbols (N runs, IUPAC codes) are handled
+          `error` raises, `skip` drops them, `split` splits the sequence at ambiguous runs
+          & `unk` maps them to the reserved `unk_id`
+        canonical (bool): strand-agnostic ids, a k-mer & its reverse complement share the id of
+          min(kmer, revcomp), which roughly halves the vocab"""
     self.kmer_size = kmer_size
+    self.unknown = self._policy(unknown)
+    self.canonical = canonical
+    self._canon = None  # code -> canonical id table, only used in canonical mode
     self.base_chars = ['A', 'T', 'G', 'C']  # upper-cased base protiens
+    self._table = None  # mmapped binary vocab, the dicts are only built from it when first needed
     self.ids_to_token, self.vocab = {}, {}
+    self._offset = None  # id of 'A' * kmer_size when the vocab is base-4 numbered, else None
 
     # Calculate the sum of powers of 5 from 4^0 to 4^5 (i.e., 4^0 + 4^1 + 4^2 + 4^3 + 4^4 + 4^5)
     # The range(6) generates numbers from 0 to 5, and for each i, we compute 4 ** i.
     # subtracting 1 from total to adjust the size
     self.vocab_size = len(self.base_chars) ** kmer_size
 
-  def tokenize(self, sequence):
+  @property
+  def vocab(self):
+    if self._vocab is None:
+      self._vocab = self._table.to_dict()
+    return self._vocab
+
+  @vocab.setter
+  def vocab(self, value):
+    self._vocab = value
+
+  @property
+  def ids_to_token(self):
+    if self._ids_to_token is None:
+      # canonical vocabs hold both strands of an id, the smaller one is the id's token
+      items = sorted(self.vocab.items(), reverse=True) if self.canonical else self.vocab.items()
+      self._ids_to_token = {v: k for k, v in items}
+    return self._ids_to_token
+
+  @ids_to_token.setter
+  def ids_to_token(self, value):
+    self._ids_to_token = value
+
+  @staticmethod
+  def _policy(unknown):
+    if unknown not in UNKNOWN_POLICIES:
+      raise ValueError(f"`{unknown}` isn't a valid policy, use one of {UNKNOWN_POLICIES}")
+    return unknown
+
+  @property
+  def unk_id(self):
+    """reserved id for k-mers containing non-ACGT symbols, one past the vocab"""
+    return self.vocab_size
+
+  def tokenize(self, sequence, unknown:str=None):
+    """splits the sequence into overlapping k-mers
+
+    Args:
+      sequence (str): DNA sequence
+      unknown (str|None): overrides the non-ACGT policy set on the instance
+    Returns:
+      List[str]: k-mers (a list of k-mer lists, one per clean segment, for the `split` policy)
+    """
+    unknown = self._policy(unknown or self.unknown)
     sequence = sequence.upper() # ensures sequence entered is upper-cased
-    if any(ch not in self.base_chars for ch in sequence):
+    bad = base_codes(sequence) == INVALID_CODE
+    k, n = self.kmer_size, len(sequence) - self.kmer_size + 1
+    if not bad.any() and unknown != "split":
+      return [sequence[i:i+k] for i in range(n)]
+    if unknown == "error":
       raise ValueError("Invalid character in DNA sequence")
-    return [sequence[i:i+self.kmer_size] for i in range(len(sequence) - self.kmer_size + 1)]
+    if unknown == "unk":  # ambiguous windows are kept as-is & mapped to `unk_id` by encode
+      return [sequence[i:i+k] for i in range(n)]
+    window_bad = _bad_windows(bad, k)
+    if unknown == "skip":
+      return [sequence[i:i+k] for i in np.flatnonzero(~window_bad).tolist()]
+    return [[sequence[i:i+k] for i in range(a, b)] for a, b in zip(*map(np.ndarray.tolist, _good_runs(window_bad)))]
 
   def detokenize(self, ids):
-    return "".join(ids[i][0] for i in range(len(ids))) + ids[-1][1:]
+    return "".join([kmer[0] for kmer in ids]) + ids[-1][1:]
 
   def build_vocab(self, continuous=False):
+    if self.canonical:
+      if continuous:
+        raise ValueError("canonical vocabs only support a fixed kmer_size")
+      return self._build_canonical_vocab()
     letters, combos = sorted(self.base_chars), []
     if continuous:
       for L in range(1, self.kmer_size + 1):
@@ -32,15 +294,240 @@ class KMer:
     self.vocab = {''.join(c): i for i, c in enumerate(combos)}
     self.ids_to_token = {v: k for k, v in self.vocab.items()}
     self.vocab_size = len(self.vocab.items())
+    self._index_vocab()
+
+  def _build_canonical_vocab(self):
+    # every k-mer stays in the vocab, but both strands point to the same compact id
+    kmers = ["".join(c) for c in product(sorted(self.base_chars), repeat=self.kmer_size)]
+    table, canonical = canonical_table(self.kmer_size)
+    self.vocab = dict(zip(kmers, table.tolist()))
+    self.ids_to_token = {i: kmers[code] for i, code in enumerate(canonical.tolist())}
+    self.vocab_size = len(canonical)
+    self._index_vocab()
+
+  def _index_vocab(self):
+    # fixed-k vocabs (and the k-sized tail of continuous ones) number k-mers in base-4 order,
+    # which lets encode/decode work on the ids arithmetically instead of through the dicts
+    self._offset, self._canon = None, None
+    if self.canonical:
+      # hashing still runs on plain base-4 codes, which are then mapped through the canonical table
+      self._offset = 0
+      self._canon = canonical_table(self.kmer_size, self.id_dtype)[0]
+      return
+    first = self.vocab.get("A" * (self.kmer_size or 0))
+    kmers = [t for t in self.vocab if len(t) == self.kmer_size]
+    if first is None or len(kmers) != 4 ** self.kmer_size:
+      return
+    codes = base_codes("".join(kmers)).reshape(-1, self.kmer_size)
+    if (codes == INVALID_CODE).any():
+      return
+    expected = codes.astype(np.int64) @ (4 ** np.arange(self.kmer_size - 1, -1, -1, dtype=np.int64)) + first
+    actual = np.fromiter((self.vocab[t] for t in kmers), dtype=np.int64, count=len(kmers))
+    if np.array_equal(expected, actual):
+      self._offset = first
+
+  @property
+  def id_dtype(self):
+    n_ids = self.vocab_size if self._offset is None else self._offset + 4 ** self.kmer_size
+    return id_dtype(max(n_ids or 0, self.unk_id or 0) + 1)  # keeps room for `unk_id`
+
+  def encode(self, sequence, unknown:str=None):
+    unknown = self._policy(unknown or self.unknown)
+    if self._offset is None:
+      tokenized_data = self.tokenize(sequence, unknown)
+      if unknown == "split":
+        return [self._lookup(segment, unknown) for segment in tokenized_data]
+      return self._lookup(tokenized_data, unknown)
+    encoded = self.encode_array(sequence, unknown)
+    return encoded.tolist()
+
+  def _lookup(self, tokens, unknown):
+    if unknown == "unk":
+      return [self.vocab.get(kmer, self.unk_id) for kmer in tokens]
+    return [self.vocab[kmer] for kmer in tokens if kmer in self.vocab]
+
+  def encode_array(self, sequence, unknown:str=None):
+    """encodes a sequence into a contiguous uint16/uint32 array of k-mer ids
+
+    Args:
+      sequence (str|bytes): DNA sequence, upper or lower-cased
+      unknown (str|None): overrides the non-ACGT policy set on the instance
+    Returns:
+      np.ndarray: ids of every overlapping k-mer, same ids as `encode`
+        (RaggedIds with one row per clean segment for the `split` policy)
+    """
+    unknown = self._policy(unknown or self.unknown)
+    if self._offset is None:
+      if isinstance(sequence, (bytes, bytearray, memoryview)):
+        sequence = bytes(sequence).decode("ascii", errors="replace")
+      encoded = self.encode(sequence, unknown)
+      if unknown == "split":
+        return _ragged([np.asarray(e, dtype=self.id_dtype) for e in encoded], self.id_dtype)
+      return np.asarray(encoded, dtype=self.id_dtype)
+    codes = base_codes(sequence)
+    bad = codes == INVALID_CODE
+    if not bad.any():
+      ids = self._canonicalize(kmer_ids(codes, self.kmer_size, self._offset, self.id_dtype))
+      return RaggedIds(ids, np.array([0, len(ids)] if len(ids) else [0], dtype=np.int64)) if unknown == "split" else ids
+    if unknown == "error":
+      raise ValueError("Invalid character in DNA sequence")
+    # flagged bases are hashed as 'A' & the windows covering them are dealt with afterwards
+    codes[bad] = 0
+    ids, window_bad = self._canonicalize(kmer_ids(codes, self.kmer_size, self._offset, self.id_dtype)), _bad_windows(bad, self.kmer_size)
+    if unknown == "unk":
+      ids[window_bad] = self.unk_id
+      return ids
+    if unknown == "skip":
+      return ids[~window_bad]
+    starts, ends = _good_runs(window_bad)
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=offsets[1:])
+    return RaggedIds(ids[~window_bad], offsets)
+
+  def _canonicalize(self, ids):
+    return ids if self._canon is None else self._canon[ids]
+
+  def encode_batch(self, sequences, n_workers:int=1, min_chunk:int=1 << 20, unknown:str=None) -> RaggedIds:
+    """encodes many sequences at once into a flat id array plus offsets
 
-  def encode(self, sequence):
-    tokenized_data = self.tokenize(sequence)
-    return [self.vocab[kmer] for kmer in tokenized_data if kmer in self.vocab]
+    Args:
+      sequences (Iterable[str|bytes]): sequences to encode, order is preserved
+      n_workers (int): number of worker processes, 1 encodes in-process
+      min_chunk (int): minimum number of bases handed to a single worker
+      unknown (str|None): overrides the non-ACGT policy, `split` isn't supported for batches
+    Returns:
+      RaggedIds: ids of sequence `i` are `ids[offsets[i]:offsets[i+1]]`
+    """
+    unknown = self._policy(unknown or self.unknown)
+    if unknown == "split":
+      raise ValueError("`split` policy isn't supported for batches, use `skip` or `unk`")
+    sequences = sequences if isinstance(sequences, list) else list(sequences)
+    if self._offset is None:
+      return _ragged([self.encode_array(s, unknown) for s in sequences], self.id_dtype)
+    total = sum(len(s) for s in sequences)
+    n_chunks = max(1, min(n_workers or 1, len(sequences), total // max(min_chunk, 1)))
+    chunk_args = dict(kmer_size=self.kmer_size, offset=self._offset, dtype=self.id_dtype, unknown=unknown, unk_id=self.unk_id, canon=self._canon)
+    if n_chunks == 1:
+      return _encode_batch_chunk(sequences, **chunk_args)
+    # balances the chunks on bases rather than on the number of sequences
+    cum = np.cumsum([len(s) for s in sequences])
+    cuts = [0] + np.searchsorted(cum, np.arange(1, n_chunks) * total / n_chunks).tolist() + [len(sequences)]
+    chunks = [sequences[a:b] for a, b in zip(cuts[:-1], cuts[1:]) if b > a]
+    with ProcessPoolExecutor(max_workers=n_chunks) as exe:
+      parts = exe.map(partial(_encode_batch_chunk, **chunk_args), chunks)
+      return RaggedIds.concat(parts, self.id_dtype)
+
+  def iter_file(self, path, chunk_bytes:int=1 << 24):
+    """streams a FASTA/plain-text file & yields id arrays chunk by chunk
+
+    the last k-1 bases of every chunk are carried over to the next one, so the concatenated
+    output equals `encode_array` over the whole sequence (k-mers never span two FASTA records)
+
+    Args:
+      path (str): FASTA or plain-text file, optionally gzipped
+      chunk_bytes (int): number of bytes read per chunk
+    Yields:
+      np.ndarray: ids of the k-mers completed by each chunk
+    """
+    if self.unknown == "split":
+      raise ValueError("`split` policy isn't supported for streamed files, use `skip` or `unk`")
+    carry = b""
+    for bases in _iter_bases(path, chunk_bytes):
+      if bases is None:
+        carry = b""
+        continue
+      seq = carry + bases
+      ids = self.encode_array(seq)
+      if len(ids):
+        yield ids
+      carry = seq[max(0, len(seq) - self.kmer_size + 1):] if self.kmer_size > 1 else b""
+
+  def encode_file(self, path, out=None, chunk_bytes:int=1 << 24):
+    """encodes a whole file with constant memory
+
+    Args:
+      path (str): FASTA or plain-text file, optionally gzipped
+      out (str|None): output path for the raw ids, if None a generator of id arrays is returned
+      chunk_bytes (int): number of bytes read per chunk
+    Returns:
+      np.memmap: read-only memmap over the written ids (or the `iter_file` generator)
+    """
+    if out is None:
+      return self.iter_file(path, chunk_bytes)
+    n_ids = 0
+    with open(out, "wb") as f:
+      for ids in self.iter_file(path, chunk_bytes):
+        f.write(ids.astype(self.id_dtype, copy=False).tobytes())
+        n_ids += len(ids)
+    if not n_ids:
+      return np.empty(0, dtype=self.id_dtype)
+    return np.memmap(out, dtype=self.id_dtype, mode="r", shape=(n_ids,))
+
+  def encode_records(self, path, unknown:str=None):
+    """encodes a FASTA/FASTQ file (optionally gzipped) record by record
+
+    Yields:
+      Tuple[str, np.ndarray]: record header & its k-mer ids
+    """
+    for header, seq in read_sequences(path):
+      yield header, self.encode_array(seq, unknown)
 
   def decode(self, ids):
-    tokens = self.ids_to_chars(ids)
+    """rebuilds the sequence from k-mer ids
+
+    Args:
+      ids (List[int]|np.ndarray|torch.Tensor): 1-D ids, `unk_id` decodes to 'N'
+    Returns:
+      str: decoded sequence
+    """
+    self._check_strand()
+    arr = as_id_array(ids)
+    if self._decodable(arr):
+      return self._decode_codes(arr.reshape(1, -1))[0].tobytes().decode("ascii")
+    tokens = self.ids_to_chars(ids if isinstance(ids, list) else arr.tolist())
     return self.detokenize(tokens)
 
+  def decode_batch(self, ids):
+    """decodes a batch of id rows in one go
+
+    Args:
+      ids (np.ndarray|torch.Tensor|RaggedIds|List[List[int]]): 2-D ids of shape (B, L) or ragged rows
+    Returns:
+      List[str]: one decoded sequence per row
+    """
+    self._check_strand()
+    if isinstance(ids, RaggedIds) or isinstance(ids, list):
+      return [self.decode(row) if len(row) else "" for row in ids]
+    arr = as_id_array(ids)
+    if arr.ndim != 2:
+      raise ValueError(f"Expected ids of shape (B, L), got {arr.shape}")
+    if not self._decodable(arr):
+      return [self.decode(row.tolist()) for row in arr]
+    return [row.tobytes().decode("ascii") for row in self._decode_codes(arr)]
+
+  def _check_strand(self):
+    if self.canonical:
+      raise ValueError("canonical ids are strand-agnostic & can't be decoded or verified as a sequence")
+
+  def _decodable(self, arr):
+    # ids of shorter k-mers (continuous vocabs) or extra tokens go through the dict path
+    if self._offset is None or arr.size == 0 or arr.dtype.kind not in "iu" or arr.min() < self._offset:
+      return False
+    last_kmer = self._offset + 4 ** self.kmer_size - 1
+    return arr.max() <= last_kmer or bool(((arr <= last_kmer) | (arr == self.unk_id)).all())
+
+  def _decode_codes(self, arr):
+    # every k-mer contributes its first base, the last one contributes its whole tail
+    k = self.kmer_size
+    codes = arr.astype(np.int64) - self._offset
+    unk = arr == self.unk_id
+    out = np.empty((arr.shape[0], arr.shape[1] + k - 1), dtype=np.uint8)
+    out[:, :arr.shape[1]] = _CODE_BASES[(codes >> (2 * (k - 1))) & 3]
+    out[:, arr.shape[1]:] = _CODE_BASES[(codes[:, -1:] >> (2 * np.arange(k - 2, -1, -1))) & 3]
+    out[:, :arr.shape[1]][unk] = ord("N")
+    out[unk[:, -1], arr.shape[1]:] = ord("N")
+    return out
+
   def ids_to_chars(self, ids: list[int]):
     """returns the list containing chars mapped to ids
 
@@ -65,16 +552,20 @@ class KMer:
     assert isinstance(chars[0], str), "only accepts tokenized strings"
     return [self.vocab[i] for i in chars]
 
-  def verify(self, ids, file=None):
+  def verify(self, ids, file=None, compact=False, fmt="npz"):
     """returns a list containing true/false values for respective matching kmers
       also saves them to a file, as needed by user
 
     Args:
       ids (List[str]): list containing tokenized chars
       file (Optional|None): file path
+      compact (bool): returns the `verify_overlaps` summary instead of one dict per pair
+      fmt (str): output for compact mode, `npz` for the mask or `jsonl` for mismatches only
     Returns:
       dictonary: dictonary containing mapped true/false pairs for verification
     """
+    if compact:
+      return self.verify_overlaps(ids, file, fmt)
     verified = []
     ids = self.ids_to_chars(ids) if isinstance(ids[0], int) else ids
     for i in range(len(ids) - 1):
@@ -86,20 +577,83 @@ class KMer:
         json.dump(verified, f)
     return verified
 
-  def save(self, path, as_json=False):
+  def overlap_mask(self, ids, block:int=1 << 22) -> np.ndarray:
+    """boolean mask of adjacent k-mers overlapping by k-1 bases, `mask[i]` checks ids[i] -> ids[i+1]"""
+    if len(ids) and isinstance(ids[0], str):
+      return np.fromiter((a[1:] == b[:-1] for a, b in zip(ids, ids[1:])), dtype=bool, count=max(len(ids) - 1, 0))
+    self._check_strand()
+    arr = as_id_array(ids)
+    if not self._decodable(arr):
+      tokens = self.ids_to_chars(arr.tolist()) if arr.size else []
+      return self.overlap_mask(tokens)
+    # suffix of every k-mer vs prefix of the next one, done block-wise to bound the int64 copies
+    k, mask = self.kmer_size, np.empty(max(len(arr) - 1, 0), dtype=bool)
+    low = (1 << (2 * (k - 1))) - 1
+    for start in range(0, len(mask), block):
+      codes = arr[start:start + block + 1].astype(np.int64) - self._offset
+      unk = codes == self.unk_id - self._offset
+      mask[start:start + block] = ((codes[:-1] & low) == (codes[1:] >> 2)) & ~unk[:-1] & ~unk[1:]
+    return mask
+
+  def verify_overlaps(self, ids, file=None, fmt="npz"):
+    """vectorized, compact alternative to `verify` for genome-sized token streams
+
+    Args:
+      ids (List[int]|np.ndarray|torch.Tensor|List[str]): encoded ids or tokenized chars
+      file (str|None): directory to write `verify.npz` (mask & mismatches) or `verify.jsonl` (mismatches only)
+      fmt (str): `npz` or `jsonl`
+    Returns:
+      dict: `mask`, `n_pairs`, `n_matches`, `n_mismatches` & `mismatches` (positions i where ids[i] -> ids[i+1] fails)
+    """
+    if fmt not in ("npz", "jsonl"):
+      raise ValueError(f"`{fmt}` isn't supported, use `npz` or `jsonl`")
+    mask = self.overlap_mask(ids)
+    mismatches = np.flatnonzero(~mask)
+    report = {
+      "mask": mask,
+      "n_pairs": len(mask),
+      "n_matches": len(mask) - len(mismatches),
+      "n_mismatches": len(mismatches),
+      "mismatches": mismatches
+    }
+    if file:
+      os.makedirs(file, exist_ok=True)
+      if fmt == "npz":
+        np.savez(os.path.join(file, "verify.npz"), **report)
+      else:
+        is_chars = len(ids) and isinstance(ids[0], str)
+        with open(os.path.join(file, "verify.jsonl"), "w", encoding="utf-8") as f:
+          for i in mismatches.tolist():
+            pair = (ids[i], ids[i + 1]) if is_chars else (self.id_to_kmer(ids[i]), self.id_to_kmer(ids[i + 1]))
+            f.write(json.dumps({"pos": i, "kmer1": pair[0], "kmer2": pair[1]}) + "\n")
+    return report
+
+  def id_to_kmer(self, idx) -> str:
+    idx = int(idx)
+    if idx == self.unk_id and idx not in self.ids_to_token:
+      return "N" * self.kmer_size
+    return self.ids_to_token[idx]
+
+  def save(self, path, as_json=False, binary=False):
       os.makedirs(os.path.dirname(path), exist_ok=True)
       data = {
         "kmer_size": self.kmer_size,
         "vocab_size": self.vocab_size,
         "trained_vocab": self.vocab
       }
-      if as_json:
+      if self.canonical:
+        data["canonical"] = True
+      if binary:
+        write_vocab(path + ".bin", self.vocab, self.kmer_size, init_vocab_size=self.vocab_size,
+          offset=None if self.canonical else self._offset, canonical=self.canonical)
+      elif as_json:
         with open(path + ".json", "w", encoding="utf-8") as f:
           json.dump(data, f, indent=2)
       else:
         with open(path + ".model", "wb") as f:
           pickle.dump(data, f)
-      print(f"DEBUGG INFO[104] [Saved] Vocabulary saved to {path + ('.json' if as_json else '.model')}")
+      ext = ".bin" if binary else (".json" if as_json else ".model")
+      logger.info("vocabulary saved to %s", path + ext)
 
   def load(self, model_path: str):
     def is_url(path):
@@ -108,20 +662,33 @@ class KMer:
     if is_url(model_path):
       # print(f"DEBUGG INFO[200] Fetching remote model from: {model_path}")
       with tempfile.NamedTemporaryFile(delete=False, suffix=".model" if model_path.endswith(".model") else ".json") as tmp_file:
-        urllib.request.urlretrieve(model_path.replace("blob/", ""), tmp_file.name)
-        model_path = tmp_file.name
-
-    if model_path.endswith(".json"):
-      with open(model_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    elif model_path.endswith(".model"):
-      with open(model_path, "rb") as f:
-        data = pickle.load(f)
+        tmp_path = tmp_file.name
+      import urllib.request
+      try:
+        urllib.request.urlretrieve(model_path.replace("blob/", ""), tmp_path)
+        return self.load(tmp_path)
+      finally:
+        os.remove(tmp_path)
+
+    if model_path.endswith(".bin"):
+      # near-constant time: only the header is parsed, the token tables stay in the mmap
+      table = VocabFile(model_path)
+      self._table, self.vocab, self.ids_to_token = table, None, None
+      self.kmer_size, self.vocab_size = table.kmer_size, table.init_vocab_size
+      self.canonical, self._offset, self._canon = bool(table.flags & FLAG_CANONICAL), table.offset, None
+      if self.canonical or self._offset is None or self._offset + 4 ** self.kmer_size != len(table):
+        self._index_vocab()
+      return
+    if model_path.endswith(".json") or model_path.endswith(".model"):
+      data = read_legacy(model_path)
     else:
-      raise TypeError("Only supports vocab file format `.model` & `.json`")
+      raise TypeError("Only supports vocab file format `.model`, `.json` & `.bin`")
 
+    self._table = None
     self.vocab = data["trained_vocab"]
     self.vocab_size = data.get("vocab_size", None)
     self.kmer_size = data.get("kmer_size", None)
-    self.ids_to_token = {v: k for k, v in self.vocab.items()}
+    self.canonical = data.get("canonical", False)
+    self.ids_to_token = None  # rebuilt from the vocab on first use
+    self._index_vocab()
     # print(f"DEBUGG INFO[201] Vocab loaded successfully with {self.vocab_size} size")
\ No newline at end of file
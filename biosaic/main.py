@@ -1,7 +1,5 @@
-from .kmer import KMer
-import os
+import os, copy, hashlib, threading
 current_directory = os.path.dirname(os.path.abspath(__file__))
-os.chdir(current_directory)
 
 pre_model = ["dna-perchar", "enigma1", "EnBERT", "enigma2"]
 pre_encoding = ["base_1k", "base_2k", "base_3k", "base_4k", "base_5k"]
@@ -11,22 +9,157 @@ main_base_url = "https://github.com/shivendrra/biosaic/blob/main/model/"  # fetc
 dev_base_url = "https://raw.githubusercontent.com/shivendrra/biosaic/dev/model/"  # fetches from dev branch
 hugginface_url = "https://huggingface.co/shivendrra/BiosaicTokenizer/resolve/main/kmers/"  # fetches from huggingface librrary
 
+bundled_model_dir = os.path.join(current_directory, "model")  # `biosaic/model/*.model`, shipped as package data
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "biosaic")
+
+_loaded, _lock = {}, threading.Lock()  # process-wide memo of loaded encodings
+
+def _is_offline(offline=None):
+  if offline is not None:
+    return offline
+  return os.environ.get("BIOSAIC_OFFLINE", "").lower() in ("1", "true", "yes")
+
+def _sha256(path):
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(1 << 20), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+def _cached(path):
+  # a cached model is only trusted when it still matches the checksum written next to it
+  checksum = path + ".sha256"
+  if not (os.path.isfile(path) and os.path.isfile(checksum)):
+    return False
+  with open(checksum, "r", encoding="utf-8") as f:
+    return f.read().strip() == _sha256(path)
+
+def _download(url, path, timeout, validate=None):
+  import urllib.request
+  root, ext = os.path.splitext(path)
+  tmp_path = f"{root}.{os.getpid()}.part{ext}"  # keeps the extension, so `validate` can load it
+  try:
+    with urllib.request.urlopen(url, timeout=timeout) as response, open(tmp_path, "wb") as f:
+      for block in iter(lambda: response.read(1 << 20), b""):
+        f.write(block)
+    if validate:
+      validate(tmp_path)  # an error or proxy page served with a 200 is never cached
+    with open(tmp_path + ".sha256", "w", encoding="utf-8") as f:
+      f.write(_sha256(tmp_path))
+    # renames are atomic, so concurrent workers never read a half-written model
+    os.replace(tmp_path + ".sha256", path + ".sha256")
+    os.replace(tmp_path, path)
+  finally:
+    for leftover in (tmp_path, tmp_path + ".sha256"):
+      if os.path.exists(leftover):
+        os.remove(leftover)
+
+def fetch_model(encoding:str, offline:bool=None, cache_dir:str=None, timeout:float=10.0) -> str:
+  """returns a local path to the `.model` file of an encoding
+
+    Args:
+      encoding (str): one of `pre_encoding`
+      offline (bool|None): skip the network & use the bundled `biosaic/model/*.model` files,
+        defaults to the `BIOSAIC_OFFLINE` environment variable
+      cache_dir (str|None): download cache, defaults to `BIOSAIC_CACHE` or ~/.cache/biosaic
+      timeout (float): network timeout in seconds
+    Returns:
+      str: checksum-verified cached copy, fresh download or (offline only) the bundled model
+    Raises:
+      ConnectionError: the model isn't cached & can't be downloaded, nothing falls back silently
+      ValueError: the download isn't a valid model for `encoding`, it's discarded"""
+  bundled = os.path.join(bundled_model_dir, encoding + ".model")
+  if _is_offline(offline):
+    if not os.path.isfile(bundled):
+      raise FileNotFoundError(f"offline mode needs the bundled model `{bundled}`")
+    return bundled
+  cache_dir = cache_dir or os.environ.get("BIOSAIC_CACHE", default_cache_dir)
+  cached = os.path.join(cache_dir, encoding + ".model")
+  if _cached(cached):
+    return cached
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    _download(dev_base_url + encoding + ".model", cached, timeout, validate=lambda path: _load_model(encoding, path))
+  except OSError as e:
+    raise ConnectionError(f"couldn't download `{encoding}` ({e}), pass `offline=True` or set "
+                          "BIOSAIC_OFFLINE=1 to use the bundled models") from e
+  return cached
+
+def _check_model(encoding, _tokenizer):
+  # ids of a `base_<k>k` encoding: every 1..k-mer in base-4 order, so k-mers start at 4 + ... + 4^(k-1)
+  kmer_size = int(encoding.split('_')[1].replace('k',''))
+  offset = sum(4 ** i for i in range(1, kmer_size))
+  if _tokenizer.kmer_size != kmer_size or _tokenizer._offset != offset or _tokenizer.vocab_size != offset + 4 ** kmer_size:
+    raise ValueError(f"model for `{encoding}` has kmer_size={_tokenizer.kmer_size} & id offset {_tokenizer._offset}, "
+                     f"expected kmer_size={kmer_size} & offset {offset}")
+
+def _load_model(encoding, path):
+  from .kmer import KMer  # pulls in numpy, only needed once a tokenizer is built
+  _tokenizer = KMer(int(encoding.split('_')[1].replace('k','')))
+  try:
+    _tokenizer.load(model_path=path)
+  except Exception as e:  # truncated or foreign files fail in many ways (pickle, KeyError, ...)
+    raise ValueError(f"`{path}` isn't a valid model for `{encoding}`: {e!r}") from e
+  _check_model(encoding, _tokenizer)
+  return _tokenizer
+
+def load_encoding(encoding:str, offline:bool=None, cache_dir:str=None, canonical:bool=False):
+  """loads an encoding once per process, later calls return the memoized KMer
+    canonical encodings are a fixed function of the k-mer size & never touch the model files
+    models are memoized per source (offline or cache dir), so an offline call never gets a downloaded model & vice versa"""
+  with _lock:
+    if canonical:
+      key = (encoding, True)
+    else:
+      offline = _is_offline(offline)
+      key = (encoding, False, offline, None if offline else cache_dir or os.environ.get("BIOSAIC_CACHE", default_cache_dir))
+    if key not in _loaded:
+      if canonical:
+        from .kmer import KMer
+        _tokenizer = KMer(int(encoding.split('_')[1].replace('k','')), canonical=True)
+        _tokenizer.build_vocab()
+      else:
+        path = fetch_model(encoding, offline=offline, cache_dir=cache_dir)
+        try:
+          _tokenizer = _load_model(encoding, path)
+        except ValueError:
+          if offline:
+            raise
+          # a cached copy that doesn't load is dropped & downloaded again, once
+          for stale in (path, path + ".sha256"):
+            if os.path.exists(stale):
+              os.remove(stale)
+          _tokenizer = _load_model(encoding, fetch_model(encoding, offline=False, cache_dir=cache_dir))
+      _loaded[key] = _tokenizer
+    return _loaded[key]
+
 class tokenizer:
-  def __init__(self, encoding:str):
+  def __init__(self, encoding:str, offline:bool=None, canonical:bool=False):
     if encoding not in pre_encoding:
       raise ValueError(f"`{encoding}` doesn't exist try using the existing encoding!")
-    self.encoding = encoding
-    get_encoding_path = dev_base_url + encoding + ".model"
+    self.encoding, self.canonical = encoding, canonical
     self.kmer_size = int(encoding.split('_')[1].replace('k',''))
-    self._tokenizer = KMer(self.kmer_size)
-    self._tokenizer.load(model_path=get_encoding_path)
+    # shallow copy: vocab tables are shared, per-instance settings (e.g. `unknown`) are not
+    self._tokenizer = copy.copy(load_encoding(encoding, offline=offline, canonical=canonical))
 
   def encode(self, sequence):
     return self._tokenizer.encode(sequence)
 
+  def encode_batch(self, sequences, n_workers:int=1):
+    return self._tokenizer.encode_batch(sequences, n_workers=n_workers)
+
+  def encode_file(self, path, out=None, chunk_bytes:int=1 << 24):
+    return self._tokenizer.encode_file(path, out=out, chunk_bytes=chunk_bytes)
+
+  def encode_records(self, path):
+    return self._tokenizer.encode_records(path)
+
   def decode(self, ids):
     return self._tokenizer.decode(ids)
 
+  def decode_batch(self, ids):
+    return self._tokenizer.decode_batch(ids)
+
   def tokenize(self, sequence):
     return self._tokenizer.tokenize(sequence)
 
@@ -42,4 +175,4 @@ class tokenizer:
     return self._tokenizer.vocab_size
 
   def __str__(self):
-    return f"biosaic.tokenizer <kmer_size={self.kmer_size}, encoding={self.encoding}>"
\ No newline at end of file
+    return f"biosaic.tokenizer <kmer_size={self.kmer_size}, encoding={self.encoding}, canonical={self.canonical}>"
@@ -0,0 +1,107 @@
+"""
+  @metrics.py
+    * instrumentation shared by the tokenizers, trainers & file helpers
+     - `logger`: the "biosaic" logger, silent unless a level/handler is set (see `set_log_level`)
+     - `metrics`: process-wide phase timers (stats, merge, encode, io) & counters (pairs, merges, tokens)
+     - hooks: callbacks receiving every event as `hook(event, fields)`
+     - `profile`: optional cProfile/tracemalloc capture around any block, e.g. a training run"""
+
+import logging, threading, time
+from contextlib import contextmanager
+
+logger = logging.getLogger("biosaic")
+logger.addHandler(logging.NullHandler())
+
+def set_log_level(level=logging.INFO):
+  """turns the library's log output on, adds a stderr handler the first time"""
+  if not any(isinstance(h, logging.StreamHandler) for h in logger.handlers):
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    logger.addHandler(handler)
+  logger.setLevel(level)
+
+class Metrics:
+  """accumulates per-phase wall time & counters, reads are cheap enough to scrape during a run"""
+  def __init__(self):
+    self.timers, self.counters, self.hooks = {}, {}, []
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def phase(self, name:str):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add_time(name, time.perf_counter() - start)
+
+  def add_time(self, name:str, seconds:float):
+    with self._lock:
+      self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+  def count(self, name:str, n:int=1):
+    with self._lock:
+      self.counters[name] = self.counters.get(name, 0) + n
+
+  def rate(self, counter:str, phase:str) -> float:
+    """e.g. `rate("tokens", "encode")` -> tokens/s spent in the encode phase"""
+    seconds = self.timers.get(phase, 0.0)
+    return self.counters.get(counter, 0) / seconds if seconds else 0.0
+
+  def emit(self, event:str, **fields):
+    """forwards an event to every hook & logs it at DEBUG"""
+    for hook in list(self.hooks):
+      hook(event, fields)
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug("%s %s", event, fields)
+
+  def add_hook(self, hook):
+    self.hooks.append(hook)
+    return hook
+
+  def remove_hook(self, hook):
+    self.hooks.remove(hook)
+
+  def snapshot(self) -> dict:
+    with self._lock:
+      return {"timers": dict(self.timers), "counters": dict(self.counters)}
+
+  def reset(self):
+    with self._lock:
+      self.timers.clear()
+      self.counters.clear()
+
+metrics = Metrics()
+
+class Profile:
+  """results of a `profile` block: `stats` (pstats.Stats|None), `peak_bytes` & `top_allocations`"""
+  def __init__(self):
+    self.stats, self.peak_bytes, self.top_allocations = None, None, []
+
+@contextmanager
+def profile(path:str=None, memory:bool=False, top:int=10):
+  """runs the block under cProfile (and tracemalloc when `memory`)
+
+  Args:
+    path (str|None): also dump the cProfile stats there, readable with `pstats`/snakeviz
+    memory (bool): trace allocations, adds noticeable overhead
+    top (int): number of allocation sites kept in `top_allocations`
+  Yields:
+    Profile: filled in once the block exits
+  """
+  import cProfile, pstats, tracemalloc
+  result, profiler = Profile(), cProfile.Profile()
+  if memory:
+    tracemalloc.start()
+  profiler.enable()
+  try:
+    yield result
+  finally:
+    profiler.disable()
+    if memory:
+      result.peak_bytes = tracemalloc.get_traced_memory()[1]
+      result.top_allocations = tracemalloc.take_snapshot().statistics("lineno")[:top]
+      tracemalloc.stop()
+    if path:
+      profiler.dump_stats(path)
+    result.stats = pstats.Stats(profiler)
+    logger.info("profile done, peak memory: %s bytes", result.peak_bytes)
@@ -1,99 +1,261 @@
 import os
-import pandas as pd
 import gzip, shutil
-import regex as re
-from Bio import SeqIO
+import re
+from .metrics import logger
+from .fasta import read_sequences
+# pandas & pyarrow are imported inside the helpers that need them, FASTA/FASTQ parsing doesn't need Biopython
 
-def parquet_to_csv(data, path, index=False):
+def _parquet_batches(data, columns=None, batch_size=1 << 16):
+  # record batches with column projection, only one batch is held in memory at a time
+  import pyarrow.parquet as pq
+  return pq.ParquetFile(data).iter_batches(batch_size=batch_size, columns=columns)
+
+def _parquet_to_delimited(data, path, sep, index, columns, batch_size):
+  rows = 0
+  with open(path, "w", encoding="utf-8", newline="") as f:
+    for batch in _parquet_batches(data, columns, batch_size):
+      df = batch.to_pandas()
+      df.index = range(rows, rows + len(df))  # keeps the row numbers of a whole-file conversion
+      df.to_csv(f, sep=sep, index=index, header=rows == 0)
+      rows += len(df)
+  logger.info("parquet converted, %d rows saved to %s", rows, path)
+  return rows
+
+def parquet_to_csv(data, path, index=False, columns=None, batch_size=1 << 16):
+  """streams a Parquet file into CSV, `columns` limits the read to those columns"""
   assert os.path.exists(path), "path doesn't exist!"
-  df = pd.read_parquet(data)
-  df.to_csv(path, sep=",", index=index)
-  print(f"Parquet to CSV conversion success!!")
-  print(f"Saved the file to the path: {path}")
+  return _parquet_to_delimited(data, path, ",", index, columns, batch_size)
 
-def parquet_to_text(data, path, index=False):
+def parquet_to_text(data, path, index=False, columns=None, batch_size=1 << 16):
+  """streams a Parquet file into tab-separated text, `columns` limits the read to those columns"""
   assert os.path.exists(path), "path doesn't exist!"
-  df = pd.read_parquet(data)
-  df.to_csv(path, sep="\t", index=False)
-  print(f"Parquet to CSV conversion success!!")
-  print(f"Saved the file to the path: {path}")
-
-def split_file(input_path, output_dir, num_files):
-  if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
-    
-  with open(input_path, "r", encoding="utf-8") as f:
-    total_lines = sum(1 for _ in f)
-    lines_per_file = total_lines // num_files
-    f.seek(0)
-        
-    for i in range(num_files):
-      output_file = os.path.join(output_dir, f"chunk_0{i+1}.txt")
-      with open(output_file, "w", encoding="utf-8") as fw:
-        lines_written = 0
-        while lines_written < lines_per_file:
-          line = f.readline()
-          if not line:
-            break
-          fw.write(line)
-          lines_written += 1
-
-def unzip(input_directory, output_directory):
+  return _parquet_to_delimited(data, path, "\t", False, columns, batch_size)
+
+def _load_kmer(encoding, unknown, offline=None, cache_dir=None):
+  import copy
+  from .main import load_encoding
+  _tokenizer = copy.copy(load_encoding(encoding, offline=offline, cache_dir=cache_dir))
+  _tokenizer.unknown = unknown
+  return _tokenizer
+
+def parquet_to_shards(data, output_directory, column="sequence", encoding="base_4k", unknown="skip", batch_size=1 << 16,
+                      offline=None, cache_dir=None):
+  """tokenizes a Parquet sequence column straight into id shards, one shard per record batch
+
+    every shard is a raw id file `shard_<i>.ids` plus `shard_<i>.offsets.npy` (row boundaries),
+    so row j of a shard is `ids[offsets[j]:offsets[j + 1]]`
+
+    Args:
+      data (str): Parquet file
+      output_directory (str): directory for the shards & `manifest.json`
+      column (str): column holding the sequences, the only one that's read
+      encoding (str): one of `biosaic.get_encodings`
+      unknown (str): policy for k-mers with ambiguous bases, `skip` or `unk` (see `KMer`)
+      batch_size (int): rows per record batch & shard
+      offline (bool|None): use the bundled models, see `biosaic.main.fetch_model`
+      cache_dir (str|None): model download cache
+    Returns:
+      List[dict]: shard, offsets file, row & id count and dtype of every shard
+  """
+  import json
+  import numpy as np
+  os.makedirs(output_directory, exist_ok=True)
+  _tokenizer, shards = _load_kmer(encoding, unknown, offline, cache_dir), []
+  for i, batch in enumerate(_parquet_batches(data, [column], batch_size)):
+    sequences = [seq or "" for seq in batch.column(0).to_pylist()]
+    encoded = _tokenizer.encode_batch(sequences)
+    name = f"shard_{i:05d}"
+    encoded.ids.astype(_tokenizer.id_dtype, copy=False).tofile(os.path.join(output_directory, name + ".ids"))
+    np.save(os.path.join(output_directory, name + ".offsets.npy"), encoded.offsets)
+    shards.append({"shard": name + ".ids", "offsets": name + ".offsets.npy", "rows": len(sequences),
+                   "n_ids": len(encoded.ids), "dtype": np.dtype(_tokenizer.id_dtype).name})
+  with open(os.path.join(output_directory, "manifest.json"), "w", encoding="utf-8") as f:
+    json.dump({"source": os.path.abspath(data), "column": column, "encoding": encoding, "shards": shards}, f, indent=2)
+  logger.info("tokenized %s into %d shards", data, len(shards))
+  return shards
+
+def _snap(f, pos, size, fasta, block=1 << 20):
+  # moves `pos` forward to the next record start (FASTA) or line start (plain text)
+  if pos <= 0 or pos >= size:
+    return min(max(pos, 0), size)
+  marker = b"\n>" if fasta else b"\n"
+  f.seek(pos - 1)
+  carry, base = b"", pos - 1
+  while True:
+    data = f.read(block)
+    if not data:
+      return size
+    buf = carry + data
+    hit = buf.find(marker)
+    if hit >= 0:
+      return base + hit + 1
+    carry = buf[-(len(marker) - 1):] if len(marker) > 1 else b""
+    base += len(buf) - len(carry)
+
+def _copy_range(input_path, output_path, start, end, block=1 << 24):
+  # one buffered copy of [start, end), counting records & lines on the way
+  records = lines = 0
+  last = b"\n"
+  with open(input_path, "rb") as src, open(output_path, "wb") as dst:
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+      data = src.read(min(block, remaining))
+      if not data:
+        break
+      records += data.count(b"\n>") + (last == b"\n" and data[:1] == b">")
+      lines += data.count(b"\n")
+      last = data[-1:]
+      dst.write(data)
+      remaining -= len(data)
+  return records, lines + (end > start and last != b"\n")
+
+def split_file(input_path, output_dir, num_files, n_workers=None, manifest="manifest.json"):
+  """splits a FASTA or plain-text file into `num_files` chunks of about equal byte size
+
+    split points are found by seeking & snapping forward to the next `>` header (FASTA) or
+    newline, so records are never cut & nothing is dropped, chunks are then copied in parallel
+
+    Args:
+      input_path (str): file to split
+      output_dir (str): directory for `chunk_0<i>.txt` files
+      num_files (int): number of chunks
+      n_workers (int|None): parallel copies, defaults to `num_files`
+      manifest (str|None): name of the JSON manifest written into `output_dir`
+    Returns:
+      dict: manifest with the byte range, record & line count of every chunk
+  """
+  import json
+  from concurrent.futures import ThreadPoolExecutor
+  os.makedirs(output_dir, exist_ok=True)
+  size = os.path.getsize(input_path)
+  with open(input_path, "rb") as f:
+    fasta = f.read(1) == b">"
+    bounds = [0]
+    for i in range(1, num_files):
+      bounds.append(max(bounds[-1], _snap(f, i * size // num_files, size, fasta)))
+    bounds.append(size)
+  paths = [os.path.join(output_dir, f"chunk_0{i+1}.txt") for i in range(num_files)]
+  # file copies release the GIL, threads keep the disk busy without pickling anything
+  with ThreadPoolExecutor(max_workers=n_workers or num_files) as exe:
+    counts = list(exe.map(_copy_range, [input_path] * num_files, paths, bounds[:-1], bounds[1:]))
+  chunks = [{"path": os.path.basename(path), "start": start, "end": end, "records": records, "lines": lines}
+            for path, start, end, (records, lines) in zip(paths, bounds[:-1], bounds[1:], counts)]
+  result = {"source": os.path.abspath(input_path), "size": size, "fasta": fasta, "chunks": chunks}
+  if manifest:
+    with open(os.path.join(output_dir, manifest), "w", encoding="utf-8") as f:
+      json.dump(result, f, indent=2)
+  logger.info("split %s into %d chunks", input_path, num_files)
+  return result
+
+def _gz_files(input_directory):
+  return [name for name in sorted(os.listdir(input_directory)) if name.endswith(".gz")]
+
+def _gunzip(input_path, output_path, buffer_size):
+  with gzip.open(input_path, "rb") as f_in, open(output_path, "wb") as f_out:
+    shutil.copyfileobj(f_in, f_out, buffer_size)
+  return output_path
+
+def unzip(input_directory, output_directory, n_workers=None, buffer_size=1 << 24):
+  """decompresses every `.gz` file of a directory, files are handled in sorted order across a process pool
+
+    Returns:
+      List[str]: paths of the decompressed files, in sorted input order"""
+  from concurrent.futures import ProcessPoolExecutor
+  os.makedirs(output_directory, exist_ok=True)
+  names = _gz_files(input_directory)
+  for file_name in sorted(set(os.listdir(input_directory)) - set(names)):
+    logger.info("Skipping non-GZip file: %s", file_name)
+  inputs = [os.path.join(input_directory, name) for name in names]
+  outputs = [os.path.join(output_directory, os.path.splitext(name)[0]) for name in names]
+  with ProcessPoolExecutor(max_workers=n_workers) as exe:
+    done = list(exe.map(_gunzip, inputs, outputs, [buffer_size] * len(names)))
+  for path in done:
+    logger.info("Unzipping complete: %s", path)
+  return done
+
+def _gz_to_shard(input_path, output_path, encoding, unknown, chunk_bytes, offline, cache_dir):
+  ids = _load_kmer(encoding, unknown, offline, cache_dir).encode_file(input_path, out=output_path, chunk_bytes=chunk_bytes)
+  return {"source": os.path.basename(input_path), "shard": os.path.basename(output_path), "n_ids": len(ids), "dtype": str(ids.dtype)}
+
+def gz_to_shards(input_directory, output_directory, encoding="base_4k", unknown="skip", n_workers=None, chunk_bytes=1 << 24,
+                 offline=None, cache_dir=None):
+  """tokenizes every `.gz` FASTA/text file straight into a raw id shard, no plain-text copy is written
+
+    Args:
+      input_directory (str): directory of `.gz` files, handled in sorted order
+      output_directory (str): directory for `<name>.ids` shards & `manifest.json`
+      encoding (str): one of `biosaic.get_encodings`
+      unknown (str): policy for k-mers with ambiguous bases, `skip` or `unk` (see `KMer`)
+      n_workers (int|None): worker processes
+      chunk_bytes (int): decompressed bytes tokenized per step
+      offline (bool|None): use the bundled models, see `biosaic.main.fetch_model`
+      cache_dir (str|None): model download cache
+    Returns:
+      List[dict]: source, shard, id count & dtype of every shard
+  """
+  import json
+  from concurrent.futures import ProcessPoolExecutor
+  from .main import _is_offline
+  # resolved & loaded once here, so a missing model fails before any work & workers only read the cache
+  offline = _is_offline(offline)
+  _load_kmer(encoding, unknown, offline, cache_dir)
   os.makedirs(output_directory, exist_ok=True)
-  files = os.listdir(input_directory)
-
-  for file_name in files:
-    input_path = os.path.join(input_directory, file_name)
-    output_path = os.path.join(output_directory, os.path.splitext(file_name)[0])
-    if file_name.endswith(".gz"):
-      print(f"Unzipping: {file_name}")
-      with gzip.open(input_path, "rb") as f_in:
-        with open(output_path, "wb") as f_out:
-          shutil.copyfileobj(f_in, f_out)
-          print(f"Unzipping complete: {output_path}")
-    else:
-      print(f"Skipping non-GZip file: {file_name}")
-
-def consolidate(input_dir, output_file):
-  files = os.listdir(input_dir)
-
-  with open(output_file, "a", encoding="utf-8") as output_file:
+  names = _gz_files(input_directory)
+  inputs = [os.path.join(input_directory, name) for name in names]
+  outputs = [os.path.join(output_directory, os.path.splitext(name)[0] + ".ids") for name in names]
+  with ProcessPoolExecutor(max_workers=n_workers) as exe:
+    n = len(names)
+    shards = list(exe.map(_gz_to_shard, inputs, outputs, [encoding] * n, [unknown] * n, [chunk_bytes] * n,
+                          [offline] * n, [cache_dir] * n))
+  with open(os.path.join(output_directory, "manifest.json"), "w", encoding="utf-8") as f:
+    json.dump({"encoding": encoding, "shards": shards}, f, indent=2)
+  logger.info("tokenized %d files into %s", len(shards), output_directory)
+  return shards
+
+def consolidate(input_dir, output_file, buffer_size=1 << 24):
+  """appends every `.txt` file of `input_dir` (sorted by name) to `output_file`, streamed with bounded buffers"""
+  files = sorted(os.listdir(input_dir))
+
+  with open(output_file, "ab") as output_file:
     for file_name in files:
       input_path = os.path.join(input_dir, file_name)
 
       if file_name.endswith(".txt") and os.path.isfile(input_path):
-        print(f"Reading: {file_name}")
-        with open(input_path, "r", encoding="utf-8") as input_file:
-          output_file.write(input_file.read())
-          output_file.write("\n")
+        logger.info("Reading: %s", file_name)
+        with open(input_path, "rb") as input_file:
+          shutil.copyfileobj(input_file, output_file, buffer_size)
+          output_file.write(b"\n")
 
-        print(f"Reading complete: {file_name}")
+        logger.info("Reading complete: %s", file_name)
       else:
-        print(f"Skipping non-text file: {file_name}")
+        logger.info("Skipping non-text file: %s", file_name)
 
 def sanitize_filename(s):
   # keep alphanumeric, dash, underscore; replace others with underscore
   return re.sub(r"[^A-Za-z0-9_\-]+", "_", s).strip("_")
 
 def merge_sequences(input_fasta, output_file):
-  with open(output_file, "w", encoding="utf-8") as out_handle:
-    for record in SeqIO.parse(input_fasta, "fasta"):
-      out_handle.write(str(record.seq) + "\n")
-  print(f"Merged {input_fasta} → {output_file} (raw DNA only)")
+  with open(output_file, "wb") as out_handle:
+    for _, seq in read_sequences(input_fasta):
+      out_handle.write(seq)
+      out_handle.write(b"\n")
+  logger.info("Merged %s → %s (raw DNA only)", input_fasta, output_file)
 
 def split_sequences(input_fasta, out_dir):
   os.makedirs(out_dir, exist_ok=True)
-  for record in SeqIO.parse(input_fasta, "fasta"):
-    name = sanitize_filename(record.description)
+  for header, seq in read_sequences(input_fasta):
+    name = sanitize_filename(header)
     path = os.path.join(out_dir, f"{name}.txt")
-    with open(path, "w", encoding="utf-8") as fh:
-      fh.write(str(record.seq) + "\n")
-    print(f"Wrote to {path}")
+    with open(path, "wb") as fh:
+      fh.write(seq)
+      fh.write(b"\n")
+    logger.info("Wrote to %s", path)
 
 def cleanse_db(input_fasta, action, output_dir="ouptut", merged_file="merged.txt"):
   """ calling function for the whole logic
     Args:
-      input_fasta (str, path): Path to input FASTA file
+      input_fasta (str, path): Path to input FASTA/FASTQ file, optionally gzipped
       action (merge, split): merge into one file or split into files
       output_dir (str, path): Directory for split files (default: output)
       merged_file (str): Filename for merged output (default: merged.txt)
@@ -0,0 +1,184 @@
+"""
+  @vocabfile.py
+    * versioned binary vocabulary format, replaces pickled/JSON vocab dicts
+     - header: magic, version, kmer_size, alphabet, token & merge counts
+     - fixed-width arrays: token ids, token offsets into a byte blob, merge table (left, right, new_id)
+    * opened through `mmap`, nothing is executed or unpickled, every size is checked against the file
+      & the header (kmer_size, id offset, base token count) against the token table
+    * Raises:
+        ValueError: malformed or truncated file"""
+
+import os, io, json, mmap, pickle, struct
+import numpy as np
+
+MAGIC, VERSION = b"BSVC", 1
+# magic, version, flags, kmer_size, alphabet length, n_tokens, n_merges, init_vocab_size, id offset, blob size
+_HEADER = struct.Struct("<4sHHHHIIIiQ")
+FLAG_POSITIONAL = 1  # k-mer ids are `offset + base-4 code`, no lookup table needed
+FLAG_CANONICAL = 2   # a k-mer & its reverse complement share one id
+MAX_KMER = 15  # ids are uint32, `offset + 4 ** kmer_size` has to stay below 2^32
+
+def _pad(n:int) -> int:
+  return -n % 8
+
+class VocabFile:
+  """read-only view over a binary vocab file, arrays are zero-copy views into the mmap"""
+  def __init__(self, path:str):
+    with open(path, "rb") as f:
+      size = os.fstat(f.fileno()).st_size
+      if size < _HEADER.size:
+        raise ValueError(f"{path} is too small to be a biosaic vocab file")
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, flags, kmer_size, n_alpha, n_tokens, n_merges, init_size, offset, n_blob = _HEADER.unpack_from(self._mmap, 0)
+    if magic != MAGIC:
+      raise ValueError(f"{path} isn't a biosaic vocab file")
+    if version != VERSION:
+      raise ValueError(f"unsupported vocab file version {version}, expected {VERSION}")
+    layout = [("alphabet", n_alpha, 1), ("ids", n_tokens, 4), ("offsets", n_tokens + 1, 8), ("blob", n_blob, 1), ("merges", n_merges * 3, 4)]
+    pos, spans = _HEADER.size + _pad(_HEADER.size), {}
+    for name, count, width in layout:
+      spans[name] = (pos, count)
+      pos += count * width
+      pos += _pad(pos)
+    if pos > size:
+      raise ValueError(f"{path} is truncated, expected {pos} bytes got {size}")
+    view = lambda name, dtype: np.frombuffer(self._mmap, dtype=dtype, count=spans[name][1], offset=spans[name][0])
+    self.kmer_size, self.init_vocab_size, self.flags = kmer_size, init_size, flags
+    self.offset = offset if flags & FLAG_POSITIONAL else None
+    self.alphabet = bytes(view("alphabet", np.uint8)).decode("ascii")
+    self.ids, self.offsets, self.blob = view("ids", "<u4"), view("offsets", "<u8"), view("blob", np.uint8)
+    self.merges = view("merges", "<u4").reshape(-1, 3)
+    if len(self.offsets) and (self.offsets[0] != 0 or self.offsets[-1] != n_blob or (np.diff(self.offsets.astype(np.int64)) < 0).any()):
+      raise ValueError(f"{path} has corrupted token offsets")
+    self._check(path, n_tokens, offset)
+
+  def _check(self, path, n_tokens, offset):
+    # header fields size the tables built from the file (e.g. 4^k canonical ids), so they must agree with what's stored
+    k = self.kmer_size
+    if not 1 <= k <= MAX_KMER:
+      raise ValueError(f"{path} has kmer_size {k}, expected 1 to {MAX_KMER}")
+    if self.init_vocab_size > n_tokens:
+      raise ValueError(f"{path} declares {self.init_vocab_size} base tokens but holds {n_tokens}")
+    if self.flags & FLAG_CANONICAL and n_tokens != 4 ** k:
+      raise ValueError(f"{path} is canonical but holds {n_tokens} tokens instead of 4^{k}")
+    if self.flags & FLAG_POSITIONAL and (offset < 0 or offset + 4 ** k > n_tokens):
+      raise ValueError(f"{path} has id offset {offset}, 4^{k} k-mer ids from there don't fit {n_tokens} tokens")
+    if n_tokens and int(self.ids.max()) >= n_tokens or len(self.merges) and int(self.merges.max()) >= n_tokens:
+      raise ValueError(f"{path} has ids outside of its {n_tokens} tokens")
+
+  def __len__(self):
+    return len(self.ids)
+
+  def token(self, i:int) -> str:
+    return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("ascii")
+
+  def items(self):
+    """yields (token, id) pairs"""
+    blob = bytes(self.blob)
+    for i, (a, b) in enumerate(zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist())):
+      yield blob[a:b].decode("ascii"), int(self.ids[i])
+
+  def to_dict(self) -> dict:
+    return dict(self.items())
+
+  def close(self):
+    self.ids = self.offsets = self.blob = self.merges = None
+    self._mmap.close()
+
+def write_vocab(path:str, vocab:dict, kmer_size:int, merges=None, init_vocab_size:int=None, offset:int=None, alphabet:str="ACGT", canonical:bool=False):
+  """writes a vocab into the binary format
+
+  Args:
+    path (str): output path, `.bin` by convention
+    vocab (dict): token string -> id
+    kmer_size (int): base k-mer size
+    merges (List[Tuple[int, int, int]]|None): BPE merge table as (left, right, new_id) in merge order
+    init_vocab_size (int|None): number of base tokens, defaults to the vocab size
+    offset (int|None): id of 'A' * kmer_size for base-4 numbered vocabs
+    alphabet (str): base alphabet
+    canonical (bool): vocab maps both strands of a k-mer to one id
+  """
+  items = sorted(vocab.items(), key=lambda kv: kv[1])
+  tokens = [t.encode("ascii") for t, _ in items]
+  offsets = np.zeros(len(tokens) + 1, dtype="<u8")
+  np.cumsum([len(t) for t in tokens], out=offsets[1:])
+  merges = np.asarray(merges if merges is not None else [], dtype="<u4").reshape(-1, 3)
+  flags = (FLAG_POSITIONAL if offset is not None else 0) | (FLAG_CANONICAL if canonical else 0)
+  header = _HEADER.pack(MAGIC, VERSION, flags, kmer_size, len(alphabet), len(tokens), len(merges),
+    len(vocab) if init_vocab_size is None else init_vocab_size, -1 if offset is None else offset, int(offsets[-1]))
+  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+  with open(path, "wb") as f:
+    for section in (header, alphabet.encode("ascii"), np.asarray([i for _, i in items], dtype="<u4").tobytes(),
+                    offsets.tobytes(), b"".join(tokens), merges.tobytes()):
+      f.write(section)
+      f.write(b"\0" * _pad(len(section)))
+
+class _SafeUnpickler(pickle.Unpickler):
+  # legacy models only hold dicts, strings & ints, which never go through `find_class`
+  def find_class(self, module, name):
+    raise pickle.UnpicklingError(f"refusing to load `{module}.{name}` from a vocab file")
+
+def read_legacy(path:str) -> dict:
+  """reads a legacy `.model` (pickle) or `.json` vocab without executing any code"""
+  if path.endswith(".json"):
+    with open(path, "r", encoding="utf-8") as f:
+      return json.load(f)
+  with open(path, "rb") as f:
+    return _SafeUnpickler(io.BytesIO(f.read())).load()
+
+def infer_merges(vocab:dict, init_vocab_size:int, kmer_size:int=None):
+  """rebuilds the (left, right, new_id) merge table of a legacy BPE vocab, which only kept the merged strings
+
+    a trained token spells its base k-mers back to back, so its base ids are the k-sized chunks of its string;
+    replaying the merges inferred so far (all below `new_id`) over them leaves exactly the pair training merged.
+    tokens that don't replay to two ids fall back to the splits at k-mer boundaries, an ambiguous or missing
+    split is logged as a warning, files saved with their `merges` never need this"""
+  from .bpe import apply_merges
+  from .metrics import logger
+  base = {t: i for t, i in vocab.items() if i < init_vocab_size}
+  k = kmer_size or max((len(t) for t in base), default=1)
+  by_id = {i: t for t, i in vocab.items()}
+  merges, ranks = [], {}
+  for new_id in sorted(i for i in by_id if i >= init_vocab_size):
+    token = by_id[new_id]
+    chunks = [token[c:c + k] for c in range(0, len(token), k)]
+    pair = None
+    if len(token) % k == 0 and all(c in base for c in chunks):
+      replayed = apply_merges([base[c] for c in chunks], ranks)
+      if len(replayed) == 2:
+        pair = tuple(replayed)
+    if pair is None:
+      splits = [(vocab[token[:cut]], vocab[token[cut:]]) for cut in range(k, len(token), k)
+                if vocab.get(token[:cut], new_id) < new_id and vocab.get(token[cut:], new_id) < new_id]
+      if len(splits) != 1:
+        logger.warning("merge of token %d `%s` is %s, %s", new_id, token, "ambiguous" if splits else "unknown",
+                       f"using {splits[0]}" if splits else "skipped")
+      if not splits:
+        continue
+      pair = splits[0]
+    merges.append((pair[0], pair[1], new_id))
+    ranks[pair] = (len(merges) - 1, new_id)
+  return merges
+
+def convert_model(model_path:str, out_path:str=None) -> str:
+  """converts a legacy `biosaic/model/*.model` (KMer or BPE) into the binary format
+
+  Returns:
+    str: path of the written `.bin` file
+  """
+  data = read_legacy(model_path)
+  out_path = out_path or os.path.splitext(model_path)[0] + ".bin"
+  kmer_size = data.get("kmer_size")
+  if "merged_vocab" in data:
+    init_size = data.get("init_vocab_size", len(data["base_vocab"]))
+    merges = data.get("merges") or infer_merges(data["merged_vocab"], init_size, kmer_size)
+    write_vocab(out_path, data["merged_vocab"], kmer_size, merges, init_size)
+  else:
+    from .kmer import KMer
+    canonical = data.get("canonical", False)
+    _kmer = KMer(kmer_size, canonical=canonical)
+    _kmer.vocab = data["trained_vocab"]
+    _kmer._index_vocab()
+    write_vocab(out_path, data["trained_vocab"], kmer_size, init_vocab_size=data.get("vocab_size"),
+      offset=None if canonical else _kmer._offset, canonical=canonical)
+  return out_path
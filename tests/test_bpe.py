@@ -0,0 +1,269 @@
+import unittest, os, random, tempfile
+import numpy as np
+from array import array
+from itertools import accumulate
+from collections import Counter
+from biosaic import bpe
+from biosaic.vocabfile import infer_merges
+from biosaic.bpe import BPE, bpe_trainer, _PairIndex, merge, apply_merges, get_kmer_ids, read_records, compare_merges, INVALID_KMER
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "biosaic", "model")
+
+def _reference_merges(ids, n_merges, first_id, starts=()):
+  # naive exact trainer: recount everything, merge the most frequent (then smallest) pair
+  bounds = sorted({0, len(ids), *starts})
+  records = [array('I', ids[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+  merges = []
+  for new_id in range(first_id, first_id + n_merges):
+    stats = Counter()
+    for rec in records:
+      stats.update(zip(rec, rec[1:]))
+    if not stats:
+      break
+    pair, _ = min(stats.items(), key=lambda kv: (-kv[1], kv[0]))
+    merges.append((pair[0], pair[1], new_id))
+    records = [merge(rec, pair, new_id) for rec in records]
+  return merges, [i for rec in records for i in rec]
+
+class TestIncrementalTrainer(unittest.TestCase):
+
+  def test_pair_index_matches_recount(self):
+    rng = random.Random(0)
+    for _ in range(25):
+      n, alphabet = rng.randint(0, 300), rng.choice([2, 3, 4, 16])
+      ids = [rng.randrange(alphabet) for _ in range(n)]
+      starts = sorted(rng.sample(range(n), min(n, 3)))
+      expected, tokens = _reference_merges(ids, 30, 100, starts)
+      index, merges = _PairIndex(ids, starts), []
+      for new_id in range(100, 130):
+        best = index.most_common()
+        if best is None:
+          break
+        index.merge(best[0], new_id)
+        merges.append((*best[0], new_id))
+      self.assertEqual(merges, expected)
+      self.assertEqual(list(index.tokens()), tokens)
+
+  def test_overlapping_runs(self):
+    index = _PairIndex([0, 0, 0, 0, 0])
+    self.assertEqual(index.most_common(), ((0, 0), 4))
+    self.assertEqual(index.merge((0, 0), 9), 2)
+    self.assertEqual(list(index.tokens()), [9, 9, 0])
+    self.assertEqual(index.most_common(), ((9, 0), 1))  # ties go to the smallest pair
+
+  def test_trainer_merges(self):
+    rng = random.Random(1)
+    trainer = bpe_trainer(2)
+    tokens = [rng.choice(list(trainer.base_vocab)) for _ in range(2000)]
+    ids = trainer._base_encode(tokens)
+    trainer._train_ids(ids, trainer.init_vocab_size + 40)
+    expected, _ = _reference_merges(list(ids), 40, trainer.init_vocab_size)
+    self.assertEqual(trainer.merges, expected)
+    by_id = {i: t for t, i in trainer.vocab.items()}
+    for left, right, new_id in trainer.merges:
+      self.assertEqual(by_id[new_id], by_id[left] + by_id[right])
+
+class TestFileTraining(unittest.TestCase):
+
+  def setUp(self):
+    rng = random.Random(6)
+    self.records = ["".join(rng.choice("ACGT") for _ in range(rng.randint(0, 400))) for _ in range(6)]
+    self.records[2] = self.records[2][:100] + "NNN" + self.records[2][100:]
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, "train.fa")
+    with open(self.path, "w") as f:
+      for i, rec in enumerate(self.records):
+        f.write(f">rec{i} test\n" + "\n".join(rec[j:j+60] for j in range(0, len(rec), 60)) + "\n")
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def _segments(self, k):
+    trainer = bpe_trainer(k)
+    out = []
+    for rec in self.records:
+      for part in rec.split("NNN"):
+        if len(part) >= k:
+          out.append([trainer.base_vocab[part[i:i+k]] for i in range(len(part) - k + 1)])
+    return out
+
+  def test_read_records(self):
+    for chunk_bytes in (7, 64, 1 << 16):
+      records = read_records(self.path, 3, chunk_bytes=chunk_bytes)
+      self.assertEqual(records.tolist(), self._segments(3))
+
+  def test_no_cross_record_pairs(self):
+    trainer = bpe_trainer(3)
+    trainer.train_from_files([self.path], trainer.init_vocab_size + 30, chunk_bytes=50)
+    segments = self._segments(3)
+    flat, starts = [i for seg in segments for i in seg], list(accumulate(len(seg) for seg in segments[:-1]))
+    expected, _ = _reference_merges(flat, 30, trainer.init_vocab_size, starts)
+    self.assertEqual(trainer.merges, expected)
+
+  def test_sampled_training(self):
+    rng = random.Random(7)
+    with open(self.path, "w") as f:
+      for i in range(200):
+        f.write(f">rec{i}\n" + "".join(rng.choice(["ACGTAC", "TTGA", "GGGCCA", "C"]) for _ in range(60)) + "\n")
+    exact, approx = bpe_trainer(2), bpe_trainer(2)
+    exact.train_from_files(self.path, exact.init_vocab_size + 20)
+    approx.train_from_files(self.path, approx.init_vocab_size + 20, sample=0.5, verify_top=10)
+    self.assertEqual(exact.verify_merges(read_records(self.path, 2), 20)["agreement"], 1.0)
+    self.assertEqual(approx.report["checked"], 10)
+    self.assertEqual(approx.verify_merges(read_records(self.path, 2), 10)["reordered"], 0)  # already in exact order
+    self.assertTrue(0 < approx.report["freq_ratio"] <= 1)
+    report = compare_merges(approx.merged_tokens(), exact.merged_tokens())
+    self.assertGreater(report["prefix"], 0)
+    self.assertGreater(report["overlap"], 0.5)
+    self.assertEqual(compare_merges(["AC", "GT"], ["AC", "TT"]), {"prefix": 1, "overlap": 0.5, "jaccard": 1 / 3, "rank_shift": 0.0})
+
+  def test_verify_reranks_by_exact_counts(self):
+    with open(self.path, "w") as f:
+      f.write(">a\n" + "AC" * 50 + "\n>b\n" + "GGTT" * 5 + "\n")
+    trainer = bpe_trainer(1)
+    trainer.merges = [(2, 2, 4), (0, 1, 5), (4, 3, 6)]  # GG learned before the far more frequent AC
+    trainer.vocab = {**trainer.base_vocab, "GG": 4, "AC": 5, "GGT": 6}
+    report = trainer.verify_merges(read_records(self.path, 1), 2)
+    self.assertEqual(report, {"checked": 2, "agreement": 0.5, "freq_ratio": 0.55, "first_divergence": 0, "reordered": 2})
+    self.assertEqual(trainer.merges, [(0, 1, 4), (2, 2, 5), (5, 3, 6)])
+    self.assertEqual(trainer.vocab["AC"], 4)
+    self.assertEqual(trainer.verify_merges(read_records(self.path, 1), 3)["reordered"], 0)
+
+  def test_checkpoint_resume(self):
+    full, first = bpe_trainer(3), bpe_trainer(3)
+    target = full.init_vocab_size + 40
+    ckpt = os.path.join(self.tmp.name, "ckpt")
+    full.train_from_files(self.path, target)
+    first.train_from_files(self.path, first.init_vocab_size + 15, checkpoint=ckpt, checkpoint_every=0.0)
+    resumed = bpe_trainer.resume(ckpt, vocab_size=target)
+    self.assertEqual(resumed.merges, full.merges)
+    self.assertEqual(resumed.vocab, full.vocab)
+    self.assertEqual(sorted(os.listdir(ckpt)), ["ids-40.u32", "pairs-40.npy", "starts-40.npy", "state.json"])
+
+class TestMergeRankEncoder(unittest.TestCase):
+
+  def test_replays_training(self):
+    rng = random.Random(5)
+    seq = "".join(rng.choice("ACGT") for _ in range(2000)) + "ACGTTGCA" * 40
+    trainer = bpe_trainer(3)
+    trainer.train(seq, trainer.init_vocab_size + 60)
+    tok = BPE()
+    tok.kmer_size, tok.base_vocab, tok.merges = 3, trainer.base_vocab, trainer.merges
+    tok.ranks = {(a, b): (r, n) for r, (a, b, n) in enumerate(trainer.merges)}
+    ids = array('I', get_kmer_ids(seq, 3).tolist())
+    for a, b, new_id in trainer.merges:
+      ids = merge(ids, (a, b), new_id)
+    self.assertEqual(tok.encode(seq), list(ids))
+    self.assertEqual(tok.encode(seq), list(ids))  # served from the cache
+
+  def test_saved_models_replay_training(self):
+    rng = random.Random(9)
+    seq = "".join(rng.choice("ACGT") for _ in range(6000))
+    windows = [seq[i:i + 60] for i in range(0, 6000, 30)]
+    with tempfile.TemporaryDirectory() as tmp:
+      for k in (2, 3):
+        trainer = bpe_trainer(k)
+        trainer.train(seq, trainer.init_vocab_size + 150)
+        expected = []
+        for window in windows:
+          ids = array('I', get_kmer_ids(window, k, trainer.base_vocab["A" * k]).tolist())
+          for a, b, new_id in trainer.merges:
+            ids = merge(ids, (a, b), new_id)
+          expected.append(list(ids))
+        for kwargs, ext in (({}, ".model"), ({"as_json": True}, ".json"), ({"binary": True}, ".bin")):
+          trainer.save(os.path.join(tmp, f"k{k}"), **kwargs)
+          tok = BPE(os.path.join(tmp, f"k{k}{ext}"))
+          self.assertEqual(tok.merges, trainer.merges)
+          self.assertEqual([tok.encode(w) for w in windows], expected, ext)
+
+  def test_infer_merges_by_replay(self):
+    rng = random.Random(9)
+    seq = "".join(rng.choice("ACGT") for _ in range(6000))
+    for k in (2, 3):
+      trainer = bpe_trainer(k)
+      trainer.train(seq, trainer.init_vocab_size + 150)
+      self.assertEqual(infer_merges(trainer.vocab, trainer.init_vocab_size, k), trainer.merges)
+    vocab = {"A": 0, "AA": 1, "AAA": 2, "AAAA": 3, "AAAAA": 4}  # odd lengths can't be replayed over 2-mers
+    with self.assertLogs("biosaic", "WARNING") as logs:
+      self.assertEqual(infer_merges(vocab, 2, 2), [(1, 0, 2), (1, 1, 3), (1, 2, 4)])
+    self.assertEqual(len(logs.output), 1)  # only `AAAAA` has two valid splits
+
+  def test_apply_merges(self):
+    ranks = {(0, 0): (0, 5), (5, 5): (1, 6), (5, 0): (2, 7)}
+    self.assertEqual(apply_merges([0, 0, 0, 0, 0], ranks), [6, 0])
+    self.assertEqual(apply_merges([], ranks), [])
+
+  def test_cache_is_bounded(self):
+    tok = BPE(cache_size=8, cache_max_len=16)
+    tok.kmer_size, tok.base_vocab = 1, {"A": 0, "C": 1, "G": 2, "T": 3}
+    for seq in ("ACGT", "TTTT", "GGGG"):
+      tok.encode(seq)
+    self.assertEqual(list(tok._cache), ["TTTT", "GGGG"])
+    self.assertEqual(tok._cached_ids, 8)
+    self.assertEqual(tok.encode("A" * 32), [0] * 32)  # longer than `cache_max_len`, never cached
+    self.assertEqual(list(tok._cache), ["TTTT", "GGGG"])
+
+class TestTableDecode(unittest.TestCase):
+
+  def test_roundtrip_shipped_model(self):
+    tok = BPE(os.path.join(MODEL_DIR, "dna_1k.model"))
+    rng = random.Random(8)
+    seqs = ["".join(rng.choice("ACGT") for _ in range(4 * rng.randint(1, 300))) for _ in range(5)]
+    for seq in seqs:
+      ids = tok.encode(seq)
+      self.assertEqual(tok.decode(ids), seq)
+      self.assertEqual(tok.decode(np.asarray(ids, dtype=np.uint32)), seq)
+    self.assertEqual(tok.decode_batch([tok.encode(s) for s in seqs]), seqs)
+    self.assertEqual(tok.decode([]), "")
+
+  def test_encode_batch(self):
+    tok = BPE(os.path.join(MODEL_DIR, "dna_1k.model"))
+    rng = random.Random(9)
+    seqs = ["".join(rng.choice("ACGTN") for _ in range(rng.randint(0, 80))) for _ in range(40)]
+    expected = [tok.encode(seq) for seq in seqs]
+    for n_workers in (1, 2):
+      batch = tok.encode_batch(seqs, n_workers=n_workers)
+      self.assertEqual(batch.tolist(), expected)
+      self.assertEqual(batch.ids.dtype, np.uint32)
+
+class TestWorkerPool(unittest.TestCase):
+
+  def setUp(self):
+    self._min, bpe.PARALLEL_MIN = bpe.PARALLEL_MIN, 0  # force the pool even for tiny inputs
+
+  def tearDown(self):
+    bpe.PARALLEL_MIN = self._min
+    bpe.shutdown_pool()
+
+  def test_get_stats(self):
+    rng = random.Random(2)
+    ids = array('I', [rng.randrange(50) for _ in range(5000)])
+    self.assertEqual(bpe.get_stats(ids), Counter(zip(ids, ids[1:])))
+
+  def test_get_kmer_ids(self):
+    rng = random.Random(11)
+    seq = "".join(rng.choice("acgtACGTN") for _ in range(2001))
+    trainer = bpe_trainer(4)
+    expected = [trainer.base_vocab.get(seq[i:i+4].upper(), INVALID_KMER) for i in range(len(seq) - 3)]
+    self.assertEqual(get_kmer_ids(seq, 4, n_workers=3).tolist(), expected)
+    pool = bpe.worker_pool(3)
+    self.assertEqual(get_kmer_ids(seq, 4, n_workers=3).tolist(), expected)
+    self.assertIs(bpe.worker_pool(3), pool)  # reused across calls
+    self.assertEqual(get_kmer_ids(seq, 4, n_workers=1).tolist(), expected)
+    self.assertEqual(len(get_kmer_ids("ACG", 4)), 0)
+
+  def test_train_splits_on_unknown_bases(self):
+    trainer = bpe_trainer(2)
+    trainer.train("ACACNNACACGTN", trainer.init_vocab_size + 6)
+    first, second = get_kmer_ids("ACAC", 2).tolist(), get_kmer_ids("ACACGT", 2).tolist()
+    expected, _ = _reference_merges(first + second, 6, trainer.init_vocab_size, [len(first)])
+    self.assertEqual(trainer.merges, expected)
+
+  def test_get_kmers(self):
+    rng = random.Random(3)
+    seq = "".join(rng.choice("acgt") for _ in range(1003))
+    expected = [seq.upper()[i:i+4] for i in range(len(seq) - 3)] + [seq.upper()[-3:]]
+    self.assertEqual(bpe.get_kmers(seq, 4), expected)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,115 @@
+import unittest, os, gzip, random, tempfile
+from biosaic.fasta import read_fasta, read_fastq, read_sequences, FastaIndex, build_index
+
+class TestFastaReader(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    rng = random.Random(0)
+    self.records = [(f"seq{i} sample description", "".join(rng.choice("ACGTN") for _ in range(rng.randint(0, 300))))
+                    for i in range(25)]
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def _write(self, name, text):
+    path = os.path.join(self.tmp.name, name)
+    with open(path, "w", newline="") as f:
+      f.write(text)
+    with gzip.open(path + ".gz", "wt", newline="") as f:
+      f.write(text)
+    return [path, path + ".gz"]
+
+  def _fasta(self, width, newline="\n"):
+    return "".join(f">{h}{newline}" + "".join(s[j:j+width] + newline for j in range(0, len(s), width)) for h, s in self.records)
+
+  def _read(self, reader, path, chunk_bytes):
+    return [(h, bytes(s).decode()) for h, s in reader(path, chunk_bytes)]
+
+  def test_fasta(self):
+    for width, newline in ((60, "\n"), (70, "\r\n"), (1000, "\n")):
+      for path in self._write("input.fa", self._fasta(width, newline)):
+        for chunk_bytes in (11, 1 << 20):
+          self.assertEqual(self._read(read_fasta, path, chunk_bytes), self.records)
+          self.assertEqual(self._read(read_sequences, path, chunk_bytes), self.records)
+
+  def test_single_line_records_are_views(self):
+    path = self._write("single.fa", self._fasta(1000))[0]
+    for _, seq in read_fasta(path):
+      self.assertIsInstance(seq, memoryview)
+      self.assertNotIn(b"\n", bytes(seq))
+
+  def test_fastq(self):
+    text = "".join(f"@{h}\n{s}\n+\n{'I' * len(s)}\n" for h, s in self.records)
+    for path in self._write("input.fq", text):
+      for chunk_bytes in (13, 1 << 20):
+        self.assertEqual(self._read(read_fastq, path, chunk_bytes), self.records)
+        self.assertEqual(self._read(read_sequences, path, chunk_bytes), self.records)
+
+  def test_malformed_fastq(self):
+    for text in ("@r1\nACGT\n", "@r1\nACGT\n+\nII\n"):
+      path = self._write("bad.fq", text)[0]
+      with self.assertRaises(ValueError):
+        list(read_fastq(path))
+
+  def test_empty(self):
+    for path in self._write("empty.fa", ""):
+      self.assertEqual(list(read_fasta(path)), [])
+
+class TestFastaIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    rng = random.Random(1)
+    self.records = {f"chr{i}": "".join(rng.choice("ACGTN") for _ in range(rng.randint(0, 500))) for i in range(8)}
+    self.rng = rng
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def _write(self, width, newline="\n"):
+    path = os.path.join(self.tmp.name, f"ref{width}.fa")
+    with open(path, "w", newline="") as f:
+      for name, seq in self.records.items():
+        f.write(f">{name} description{newline}" + "".join(seq[j:j+width] + newline for j in range(0, len(seq), width)))
+    return path
+
+  def test_fetch(self):
+    for width, newline in ((60, "\n"), (37, "\r\n"), (1000, "\n")):
+      with FastaIndex(self._write(width, newline)) as index:
+        self.assertEqual(index.names, list(self.records))
+        for name, seq in self.records.items():
+          self.assertEqual(index.length(name), len(seq))
+          self.assertEqual(index.fetch(name), seq.encode())
+          for _ in range(20):
+            start = self.rng.randint(0, len(seq))
+            end = self.rng.randint(start, len(seq) + 5)
+            self.assertEqual(index.fetch(name, start, end).decode(), seq[start:end])
+
+  def test_fai_file(self):
+    path = self._write(60)
+    with FastaIndex(path):
+      pass
+    with open(path + ".fai") as f:
+      first = f.readline().split("\t")
+    seq = self.records["chr0"]
+    self.assertEqual(first, ["chr0", str(len(seq)), str(len(">chr0 description\n")), "60", "61\n"])
+    with FastaIndex(path) as index:  # reuses the existing index
+      self.assertEqual(index.fetch("chr0", 5, 70).decode(), seq[5:70])
+
+  def test_sample(self):
+    with FastaIndex(self._write(60)) as index:
+      windows = index.sample(50, 40, seed=3)
+      self.assertEqual(windows, index.sample(50, 40, seed=3))
+    for name, start, seq in windows:
+      self.assertEqual(seq.decode(), self.records[name][start:start + 40])
+
+  def test_uneven_lines(self):
+    path = os.path.join(self.tmp.name, "uneven.fa")
+    with open(path, "w") as f:
+      f.write(">a\nACGT\nAC\nACGT\n")
+    with self.assertRaises(ValueError):
+      build_index(path)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,35 @@
+import unittest, os, sys, json, subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY = ["numpy", "pandas", "Bio", "regex", "requests", "urllib.request", "biosaic.process", "biosaic.database"]
+
+# measured in a fresh interpreter, so modules already imported by the test runner don't hide regressions
+BENCH = """
+import os, sys, time, json
+cwd = os.getcwd()
+start = time.perf_counter()
+import biosaic
+biosaic.tokenizer
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "cwd_changed": os.getcwd() != cwd, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY,)
+
+class TestImports(unittest.TestCase):
+
+  def test_import_is_light_and_side_effect_free(self):
+    out = subprocess.run([sys.executable, "-c", BENCH], cwd=ROOT, capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout)
+    self.assertFalse(result["cwd_changed"])
+    self.assertEqual(result["loaded"], [])
+    self.assertLess(result["elapsed"], 0.25)
+
+  def test_lazy_attributes(self):
+    import biosaic
+    self.assertIn("base_3k", biosaic.get_encodings)
+    self.assertTrue(callable(biosaic.split_file))
+    with self.assertRaises(AttributeError):
+      biosaic.not_a_biosaic_attribute
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,5 +1,10 @@
-import unittest
+import unittest, os, random, tempfile
+import numpy as np
 from biosaic import tokenizer
+from biosaic.kmer import KMer
+from biosaic.vocabfile import VocabFile, convert_model, write_vocab, _HEADER
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "biosaic", "model")
 
 class TestKMer(unittest.TestCase):
 
@@ -77,5 +82,159 @@ class TestKMer(unittest.TestCase):
       token.encode("AGCTXXAGC")
 
 
+class TestKMerEngine(unittest.TestCase):
+
+  def setUp(self):
+    rng = random.Random(1600)
+    self.sequence = "".join(rng.choice("ACGTacgt") for _ in range(2000))
+
+  def test_encode_array_matches_shipped_vocabs(self):
+    for n in range(1, 8):
+      km = KMer()
+      km.load(model_path=os.path.join(MODEL_DIR, f"base_{n}k.model"))
+      seq = self.sequence.upper()
+      expected = [km.vocab[seq[i:i+km.kmer_size]] for i in range(len(seq) - km.kmer_size + 1)]
+      encoded = km.encode_array(self.sequence)
+      self.assertIn(encoded.dtype, (np.uint16, np.uint32))
+      self.assertTrue(encoded.flags["C_CONTIGUOUS"])
+      self.assertEqual(encoded.tolist(), expected)
+
+  def test_encode_array_continuous_vocab(self):
+    km = KMer(3)
+    km.build_vocab(continuous=True)
+    self.assertEqual(km.encode_array("TCTTACATAG").tolist(), [75, 51, 80, 69, 24, 39, 32, 70])
+    with self.assertRaises(ValueError):
+      km.encode_array("AGCTXXAGC")
+
+  def test_encode_batch_ragged(self):
+    km = KMer(4)
+    km.build_vocab()
+    rng = random.Random(7)
+    sequences = ["".join(rng.choice("ACGT") for _ in range(rng.randint(0, 60))) for _ in range(200)]
+    expected = [km.encode(s) for s in sequences]
+    for n_workers in (1, 2):
+      batch = km.encode_batch(sequences, n_workers=n_workers, min_chunk=256)
+      self.assertEqual(len(batch), len(sequences))
+      self.assertEqual(batch.offsets[-1], len(batch.ids))
+      self.assertEqual(batch.tolist(), expected)
+
+  def test_encode_file_matches_whole_string(self):
+    km = KMer(5)
+    km.build_vocab()
+    rng = random.Random(3)
+    records = ["".join(rng.choice("ACGT") for _ in range(rng.randint(0, 300))) for _ in range(10)]
+    expected = np.concatenate([km.encode_array(r) for r in records])
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, "seqs.fasta")
+      with open(path, "w", encoding="utf-8") as f:
+        for i, r in enumerate(records):
+          f.write(f">record_{i}\n" + "".join(r[j:j+60] + "\n" for j in range(0, len(r), 60)))
+      for chunk_bytes in (1, 7, 1 << 16):
+        streamed = np.concatenate(list(km.encode_file(path, chunk_bytes=chunk_bytes)))
+        self.assertTrue(np.array_equal(streamed, expected))
+      written = km.encode_file(path, out=os.path.join(tmp, "ids.bin"), chunk_bytes=64)
+      self.assertTrue(np.array_equal(written, expected))
+      del written
+
+  def test_unknown_policies(self):
+    km = KMer(3)
+    km.build_vocab()
+    sequence = "ACGTNNACGTTRAC"
+    with self.assertRaises(ValueError):
+      km.encode(sequence)
+    self.assertEqual(km.tokenize(sequence, unknown="skip"), ["ACG", "CGT", "ACG", "CGT", "GTT"])
+    self.assertEqual(km.encode(sequence, unknown="skip"), [6, 27, 6, 27, 47])
+    self.assertEqual(km.encode(sequence, unknown="split"), [[6, 27], [6, 27, 47]])
+    self.assertEqual(km.encode_array(sequence, unknown="split").tolist(), [[6, 27], [6, 27, 47]])
+    unk = km.encode(sequence, unknown="unk")
+    self.assertEqual(len(unk), len(sequence) - 2)
+    self.assertEqual(unk.count(km.unk_id), 7)
+    batch = KMer(3, unknown="skip")
+    batch.build_vocab()
+    self.assertEqual(batch.encode_batch(["ACGTN", "NNNN", "ACGTAC"]).tolist(), [[6, 27], [], [6, 27, 44, 49]])
+
+  def test_decode_arrays(self):
+    for continuous in (False, True):
+      km = KMer(5)
+      km.build_vocab(continuous=continuous)
+      sequence = self.sequence.upper()
+      ids = km.encode_array(sequence)
+      self.assertEqual(km.decode(ids), sequence)
+      self.assertEqual(km.decode(ids.tolist()), sequence)
+      rows = np.stack([ids[:100], ids[100:200]])
+      self.assertEqual(km.decode_batch(rows), [sequence[:104], sequence[100:204]])
+    km = KMer(3)
+    km.build_vocab()
+    self.assertEqual(km.decode(km.encode("ACGNTTA", unknown="unk")), "ANNNTTA")
+
+  def test_verify_compact(self):
+    km = KMer(4)
+    km.build_vocab()
+    ids = np.concatenate([km.encode_array(self.sequence[:500]), km.encode_array("GGGGCC")])
+    expected = [pair["match"] for pair in km.verify(ids.tolist())]
+    with tempfile.TemporaryDirectory() as tmp:
+      report = km.verify(ids, file=tmp, compact=True)
+      self.assertEqual(report["mask"].tolist(), expected)
+      self.assertEqual(report["n_mismatches"], 1)
+      self.assertEqual(report["mismatches"].tolist(), [len(ids) - 4])
+      self.assertTrue(os.path.isfile(os.path.join(tmp, "verify.npz")))
+      km.verify_overlaps(ids, file=tmp, fmt="jsonl")
+      with open(os.path.join(tmp, "verify.jsonl"), encoding="utf-8") as f:
+        self.assertEqual(len(f.readlines()), 1)
+
+  def test_canonical_mode(self):
+    complement = str.maketrans("ACGT", "TGCA")
+    for k in (3, 4):
+      km = KMer(k, canonical=True)
+      km.build_vocab()
+      self.assertEqual(km.vocab_size, (4 ** k + (4 ** (k // 2) if k % 2 == 0 else 0)) // 2)
+      sequence = self.sequence.upper()
+      reverse = sequence[::-1].translate(complement)
+      ids = km.encode_array(sequence)
+      self.assertEqual(ids.tolist(), km.encode_array(reverse)[::-1].tolist())
+      for kmer, idx in zip(km.tokenize(sequence), ids.tolist()):
+        self.assertEqual(km.ids_to_token[idx], min(kmer, kmer[::-1].translate(complement)))
+      with self.assertRaises(ValueError):
+        km.decode(ids)
+
+  def test_binary_vocab_roundtrip(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      for n in (3, 7):
+        legacy = KMer()
+        legacy.load(model_path=os.path.join(MODEL_DIR, f"base_{n}k.model"))
+        km = KMer()
+        km.load(model_path=convert_model(os.path.join(MODEL_DIR, f"base_{n}k.model"), os.path.join(tmp, f"base_{n}k.bin")))
+        self.assertEqual(km.encode(self.sequence), legacy.encode(self.sequence))
+        self.assertEqual(km.vocab, legacy.vocab)
+      with open(os.path.join(tmp, "broken.bin"), "wb") as f:
+        f.write(b"BSVC" + bytes(64))
+      with self.assertRaises(ValueError):
+        VocabFile(os.path.join(tmp, "broken.bin"))
+
+  def test_binary_vocab_rejects_inconsistent_headers(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, "vocab.bin")
+      km = KMer(2, canonical=True)
+      km.build_vocab()
+      km.save(os.path.join(tmp, "canonical"), binary=True)
+      loaded = KMer()
+      loaded.load(os.path.join(tmp, "canonical.bin"))
+      self.assertEqual(loaded.encode("ACGTTG"), km.encode("ACGTTG"))
+      vocab = {"".join(p): i for i, p in enumerate((a, b) for a in "ACGT" for b in "ACGT")}
+      write_vocab(path, vocab, 2, offset=0)
+      KMer().load(path)
+      for fields in ({"flags": 2, "kmer_size": 14}, {"kmer_size": 0}, {"kmer_size": 40}, {"flags": 1, "offset": 4},
+                     {"init_size": 17}):
+        write_vocab(path, vocab, 2, offset=0)
+        with open(path, "r+b") as f:
+          header = dict(zip(["magic", "version", "flags", "kmer_size", "n_alpha", "n_tokens", "n_merges", "init_size", "offset", "n_blob"],
+                            _HEADER.unpack(f.read(_HEADER.size))))
+          header.update(fields)
+          f.seek(0)
+          f.write(_HEADER.pack(*header.values()))
+        with self.assertRaises(ValueError, msg=str(fields)):
+          KMer().load(path)
+
+
 if __name__ == "__main__":
   unittest.main()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import unittest, io, random, contextlib, logging
+from biosaic.bpe import bpe_trainer
+from biosaic.metrics import metrics, profile, logger
+
+class TestMetrics(unittest.TestCase):
+
+  def setUp(self):
+    metrics.reset()
+    rng = random.Random(10)
+    self.seq = "".join(rng.choice("ACGT") for _ in range(3000))
+
+  def test_silent_by_default(self):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+      bpe_trainer(2).train(self.seq, 16 + 10)
+    self.assertEqual(out.getvalue(), "")
+
+  def test_hooks_and_counters(self):
+    events = []
+    hook = metrics.add_hook(lambda event, fields: events.append((event, fields)))
+    try:
+      trainer = bpe_trainer(2)
+      trainer.train(self.seq, trainer.init_vocab_size + 12)
+    finally:
+      metrics.remove_hook(hook)
+    merges = [fields for event, fields in events if event == "merge"]
+    self.assertEqual([m["new_id"] for m in merges], [new_id for _, _, new_id in trainer.merges])
+    snap = metrics.snapshot()
+    self.assertEqual(snap["counters"]["merges"], 12)
+    self.assertEqual(snap["counters"]["tokens"], len(self.seq) - 1)
+    self.assertIn("stats", snap["timers"])
+    self.assertGreater(metrics.rate("merges", "merge"), 0)
+
+  def test_debug_logging(self):
+    with self.assertLogs(logger, level=logging.DEBUG) as logs:
+      bpe_trainer(2).train(self.seq, 16 + 3)
+    self.assertTrue(any("merge" in line for line in logs.output))
+
+  def test_profile(self):
+    with profile(memory=True) as prof:
+      bpe_trainer(2).train(self.seq, 16 + 5)
+    self.assertIsNotNone(prof.stats)
+    self.assertGreater(prof.peak_bytes, 0)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,151 @@
+import unittest, os, gzip, json, random, tempfile, pathlib
+from unittest import mock
+import numpy as np
+from biosaic import main
+from biosaic.kmer import KMer
+from biosaic.process import split_file, unzip, consolidate, gz_to_shards, cleanse_db, parquet_to_csv, parquet_to_text, parquet_to_shards
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "biosaic", "model")
+
+class TestSplitFile(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    rng = random.Random(0)
+    self.records = [f">rec{i} test\n" + "".join(rng.choice("ACGT") + ("\n" if j % 60 == 59 else "") for j in range(rng.randint(0, 900))) + "\n"
+                    for i in range(40)]
+    self.path = os.path.join(self.tmp.name, "input.fa")
+    with open(self.path, "w") as f:
+      f.write("".join(self.records))
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_split_keeps_records_whole(self):
+    out = os.path.join(self.tmp.name, "chunks")
+    result = split_file(self.path, out, 6)
+    parts = [open(os.path.join(out, c["path"])).read() for c in result["chunks"]]
+    self.assertEqual("".join(parts), "".join(self.records))
+    self.assertTrue(all(p.startswith(">") for p in parts if p))
+    self.assertEqual(sum(c["records"] for c in result["chunks"]), len(self.records))
+    self.assertEqual([c["records"] for c in result["chunks"]], [p.count(">") for p in parts])
+    with open(os.path.join(out, "manifest.json")) as f:
+      self.assertEqual(json.load(f), result)
+
+  def test_cleanse_db(self):
+    merged = os.path.join(self.tmp.name, "merged.txt")
+    cleanse_db(self.path, "merge", merged_file=merged)
+    sequences = [r.split("\n", 1)[1].replace("\n", "") for r in self.records]
+    with open(merged) as f:
+      self.assertEqual(f.read(), "".join(s + "\n" for s in sequences))
+    out = os.path.join(self.tmp.name, "split")
+    cleanse_db(self.path, "split", output_dir=out)
+    with open(os.path.join(out, "rec3_test.txt")) as f:
+      self.assertEqual(f.read(), sequences[3] + "\n")
+
+  def test_split_plain_text(self):
+    path = os.path.join(self.tmp.name, "input.txt")
+    with open(path, "w") as f:
+      f.write("\n".join("ACGT" * i for i in range(1, 101)))
+    out = os.path.join(self.tmp.name, "text")
+    result = split_file(path, out, 3, manifest=None)
+    parts = [open(os.path.join(out, c["path"])).read() for c in result["chunks"]]
+    self.assertEqual("".join(parts), open(path).read())
+    self.assertTrue(all(p.endswith("\n") for p in parts[:-1]))
+    self.assertEqual(sum(c["lines"] for c in result["chunks"]), 100)
+    self.assertFalse(os.path.exists(os.path.join(out, "manifest.json")))
+
+class TestStreamingHelpers(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.src = os.path.join(self.tmp.name, "src")
+    os.makedirs(self.src)
+    rng = random.Random(1)
+    self.seqs = {}
+    for name in ("b", "a", "c"):
+      self.seqs[name] = "".join(rng.choice("ACGTN") for _ in range(400))
+      with gzip.open(os.path.join(self.src, name + ".fa.gz"), "wt") as f:
+        f.write(f">{name}\n{self.seqs[name]}\n")
+      with open(os.path.join(self.src, name + ".txt"), "w") as f:
+        f.write(self.seqs[name])
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_unzip_sorted(self):
+    out = os.path.join(self.tmp.name, "plain")
+    paths = unzip(self.src, out, n_workers=2)
+    self.assertEqual([os.path.basename(p) for p in paths], ["a.fa", "b.fa", "c.fa"])
+    with open(paths[1]) as f:
+      self.assertEqual(f.read(), f">b\n{self.seqs['b']}\n")
+
+  def test_consolidate_sorted(self):
+    out = os.path.join(self.tmp.name, "all.txt")
+    consolidate(self.src, out, buffer_size=64)
+    with open(out) as f:
+      self.assertEqual(f.read(), "".join(self.seqs[n] + "\n" for n in ("a", "b", "c")))
+
+  def test_gz_to_shards(self):
+    out = os.path.join(self.tmp.name, "shards")
+    shards = gz_to_shards(self.src, out, "base_3k", n_workers=2, offline=True)
+    self.assertEqual([s["source"] for s in shards], ["a.fa.gz", "b.fa.gz", "c.fa.gz"])
+    self.assertFalse(any(name.endswith(".fa") for name in os.listdir(out)))
+    _kmer = KMer(3, unknown="skip")
+    _kmer.load(os.path.join(MODEL_DIR, "base_3k.model"))
+    ids = np.fromfile(os.path.join(out, shards[0]["shard"]), dtype=shards[0]["dtype"])
+    self.assertEqual(ids.tolist(), _kmer.encode_array(self.seqs["a"]).tolist())
+
+  def test_gz_to_shards_uses_model_cache(self):
+    out, cache = os.path.join(self.tmp.name, "shards"), os.path.join(self.tmp.name, "cache")
+    with mock.patch.object(main, "dev_base_url", pathlib.Path(MODEL_DIR).resolve().as_uri() + "/"), \
+         mock.patch.dict(os.environ, {"BIOSAIC_OFFLINE": ""}):
+      shards = gz_to_shards(self.src, out, "base_3k", n_workers=2, offline=False, cache_dir=cache)
+    self.assertEqual(sorted(os.listdir(cache)), ["base_3k.model", "base_3k.model.sha256"])
+    self.assertEqual(len(shards), 3)
+
+class TestParquet(unittest.TestCase):
+
+  def setUp(self):
+    import pyarrow as pa, pyarrow.parquet as pq
+    self.tmp = tempfile.TemporaryDirectory()
+    rng = random.Random(2)
+    self.seqs = ["".join(rng.choice("ACGTN") for _ in range(rng.randint(0, 300))) for _ in range(25)] + [None]
+    table = pa.table({"id": list(range(len(self.seqs))), "sequence": self.seqs, "label": [f"l{i % 3}" for i in range(len(self.seqs))]})
+    self.path = os.path.join(self.tmp.name, "data.parquet")
+    pq.write_table(table, self.path, row_group_size=10)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_batched_conversion_matches_pandas(self):
+    import pandas as pd
+    df = pd.read_parquet(self.path)
+    for convert, sep, index in ((parquet_to_csv, ",", True), (parquet_to_text, "\t", False)):
+      out = os.path.join(self.tmp.name, "out.txt")
+      open(out, "w").close()
+      self.assertEqual(convert(self.path, out, index=index, batch_size=7), len(self.seqs))
+      with open(out, newline="") as f:
+        self.assertEqual(f.read(), df.to_csv(sep=sep, index=index))
+    parquet_to_csv(self.path, out, columns=["label"], batch_size=4)
+    with open(out, newline="") as f:
+      self.assertEqual(f.read(), df[["label"]].to_csv(index=False))
+
+  def test_parquet_to_shards(self):
+    out = os.path.join(self.tmp.name, "shards")
+    shards = parquet_to_shards(self.path, out, encoding="base_3k", batch_size=8, offline=True)
+    self.assertEqual([s["rows"] for s in shards], [8, 8, 8, 2])
+    _kmer = KMer(3, unknown="skip")
+    _kmer.load(os.path.join(MODEL_DIR, "base_3k.model"))
+    rows = []
+    for s in shards:
+      ids = np.fromfile(os.path.join(out, s["shard"]), dtype=s["dtype"])
+      offsets = np.load(os.path.join(out, s["offsets"]))
+      self.assertEqual(len(ids), s["n_ids"])
+      rows += [ids[a:b].tolist() for a, b in zip(offsets[:-1], offsets[1:])]
+    self.assertEqual(rows, [_kmer.encode_array(seq or "").tolist() for seq in self.seqs])
+    with open(os.path.join(out, "manifest.json")) as f:
+      self.assertEqual(json.load(f)["shards"], shards)
+
+if __name__ == "__main__":
+  unittest.main()
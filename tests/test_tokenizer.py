@@ -0,0 +1,93 @@
+import unittest, os, pickle, tempfile, pathlib
+from biosaic import main, tokenizer
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "biosaic", "model")
+
+class TestModelCache(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.dev_base_url, self.loaded = main.dev_base_url, dict(main._loaded)
+    main.dev_base_url = pathlib.Path(MODEL_DIR).resolve().as_uri() + "/"
+    main._loaded.clear()
+
+  def tearDown(self):
+    main.dev_base_url = self.dev_base_url
+    main._loaded.clear()
+    main._loaded.update(self.loaded)
+    self.tmp.cleanup()
+
+  def test_download_is_cached_and_verified(self):
+    path = main.fetch_model("base_4k", offline=False, cache_dir=self.tmp.name)
+    self.assertEqual(os.path.dirname(path), self.tmp.name)
+    self.assertTrue(main._cached(path))
+    with open(path, "ab") as f:
+      f.write(b"corrupted")
+    self.assertFalse(main._cached(path))
+    self.assertEqual(main.fetch_model("base_4k", offline=False, cache_dir=self.tmp.name), path)
+    self.assertTrue(main._cached(path))
+    self.assertEqual(sorted(os.listdir(self.tmp.name)), ["base_4k.model", "base_4k.model.sha256"])
+
+  def test_offline_uses_bundled_models(self):
+    main.dev_base_url = "http://127.0.0.1:9/"
+    path = main.fetch_model("base_4k", offline=True, cache_dir=self.tmp.name)
+    self.assertEqual(os.path.realpath(path), os.path.realpath(os.path.join(MODEL_DIR, "base_4k.model")))
+    self.assertEqual(os.listdir(self.tmp.name), [])
+
+  def test_construction_is_memoized(self):
+    first, second = tokenizer("base_4k", offline=True), tokenizer("base_4k", offline=True)
+    self.assertIs(first.vocab, second.vocab)
+    self.assertEqual(first.encode("ACGTACGT"), second.encode("ACGTACGT"))
+
+  def test_network_errors_are_not_hidden(self):
+    main.dev_base_url = "http://127.0.0.1:9/"
+    with self.assertRaises(ConnectionError):
+      main.fetch_model("base_4k", offline=False, cache_dir=self.tmp.name, timeout=1)
+
+  def test_memo_is_keyed_by_source(self):
+    online = main.load_encoding("base_3k", offline=False, cache_dir=self.tmp.name)
+    offline = main.load_encoding("base_3k", offline=True)
+    self.assertIsNot(online, offline)
+    self.assertIs(main.load_encoding("base_3k", offline=False, cache_dir=self.tmp.name), online)
+    self.assertEqual(online.encode("TCTTACATAG"), offline.encode("TCTTACATAG"))
+
+  def test_bundled_models_match_encodings(self):
+    for k in range(1, 6):
+      _tokenizer = tokenizer(f"base_{k}k", offline=True)
+      self.assertEqual(len(_tokenizer.encode("ACGTAC")), 7 - k)
+    self.assertEqual(tokenizer("base_3k", offline=True).encode("TCTTACATAG")[:3], [75, 51, 80])
+
+  def _serve(self, name, data):
+    # a fake remote: `dev_base_url` pointed at a directory holding `name`
+    remote = os.path.join(self.tmp.name, "remote")
+    os.makedirs(remote, exist_ok=True)
+    with open(os.path.join(remote, name), "wb") as f:
+      f.write(data)
+    main.dev_base_url = pathlib.Path(remote).resolve().as_uri() + "/"
+
+  def _fixed_3k(self):
+    kmers = ["".join(p) for p in ((a, b, c) for a in "ACGT" for b in "ACGT" for c in "ACGT")]
+    return pickle.dumps({"kmer_size": 3, "vocab_size": 64, "trained_vocab": {t: i for i, t in enumerate(kmers)}})
+
+  def test_invalid_downloads_are_not_cached(self):
+    cache = os.path.join(self.tmp.name, "cache")
+    for body in (b"<html>proxy error</html>", self._fixed_3k()):
+      self._serve("base_3k.model", body)
+      with self.assertRaises(ValueError):
+        main.load_encoding("base_3k", offline=False, cache_dir=cache)
+      self.assertEqual(os.listdir(cache), [])
+
+  def test_bad_cached_model_is_replaced(self):
+    path = os.path.join(self.tmp.name, "base_3k.model")
+    with open(path, "wb") as f:
+      f.write(self._fixed_3k())
+    with open(path + ".sha256", "w") as f:
+      f.write(main._sha256(path))
+    _tokenizer = main.load_encoding("base_3k", offline=False, cache_dir=self.tmp.name)
+    self.assertEqual(_tokenizer.encode("TCTTACATAG")[:3], [75, 51, 80])
+    with open(path, "rb") as f, open(os.path.join(MODEL_DIR, "base_3k.model"), "rb") as g:
+      self.assertEqual(f.read(), g.read())
+    self.assertTrue(main._cached(path))
+
+if __name__ == "__main__":
+  unittest.main()